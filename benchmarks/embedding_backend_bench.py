@@ -0,0 +1,61 @@
+"""Parity check and throughput benchmark for the embedding backends.
+
+    python -m benchmarks.embedding_backend_bench --texts 512 --min-cosine 0.99
+
+Encodes the same texts with the torch and ONNX backends, reports per-text cosine
+similarity between them, and exits non-zero if any pair falls below --min-cosine.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from services.embedding_backends import build_encoder
+
+SAMPLE_TEXTS = [
+    "Summary: Q4 revenue grew 12% driven by enterprise renewals",
+    "Metrics: churn rate: 3.2%, ARPU: 41.5, active users: 18200",
+    "Trends: marketing spend up, conversion flat, support tickets down",
+    "sales trends",
+    "customer churn by region",
+    "Inventory turnover slowed in the northeast warehouses while returns increased",
+]
+
+def make_corpus(n: int):
+    return [f"{SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]} (variant {i})" for i in range(n)]
+
+def throughput(encoder, texts, batch_size):
+    encoder.encode(texts[:batch_size], batch_size=batch_size)  # warm up
+    t0 = time.perf_counter()
+    vectors = encoder.encode(texts, batch_size=batch_size)
+    elapsed = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for text in texts[:100]:
+        encoder.encode(text)
+    single_ms = (time.perf_counter() - t0) / min(len(texts), 100) * 1000
+    return np.asarray(vectors), len(texts) / elapsed, single_ms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    args = parser.parse_args()
+
+    texts = make_corpus(args.texts)
+    results = {}
+    for backend in ("torch", "onnx"):
+        vectors, per_sec, single_ms = throughput(build_encoder(backend), texts, args.batch_size)
+        results[backend] = vectors
+        print(f"{backend:<6} {per_sec:>9.1f} texts/s batched   {single_ms:>7.2f} ms/query single")
+
+    cosine = np.sum(results["torch"] * results["onnx"], axis=1)  # both backends normalize
+    print(f"cosine(torch, onnx): min={cosine.min():.4f} mean={cosine.mean():.4f}")
+    if cosine.min() < args.min_cosine:
+        print(f"FAIL: parity below {args.min_cosine}")
+        sys.exit(1)
+    print("parity OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""PDFs/sec of report rendering under concurrency: in-thread vs the process pool.
+
+    python -m benchmarks.pdf_render_bench --pdfs 200 --concurrency 16 --workers 4
+
+"inline" renders on a thread pool the way the endpoints used to (GIL-bound);
+"pool" goes through PdfRenderPool, including its admission limit.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services.pdf_render_pool import PdfRenderPool
+from services.pdf_service import render_pdf_bytes
+
+def sample_report(i: int) -> dict:
+    return {
+        "summary": f"Quarterly performance summary {i}. " * 8,
+        "key_metrics": [
+            {"name": f"Metric {m}", "value": round(1000 * m / (i + 1), 2), "unit": "USD"}
+            for m in range(12)
+        ],
+        "trends": [
+            {"description": f"Trend {t} in segment {i}", "direction": "up", "impact": "positive"}
+            for t in range(6)
+        ],
+        "correlations": [f"Correlation {c} between spend and conversions" for c in range(4)],
+        "recommendations": [
+            {"priority": "high", "action": f"Action {r}", "rationale": "Because the data says so. " * 4}
+            for r in range(5)
+        ],
+        "visual_insights": [f"Chart {v} shows a seasonal peak" for v in range(4)],
+        "generated_at": "2024-01-01T00:00:00"
+    }
+
+def run(render, pdfs: int, concurrency: int):
+    reports = [sample_report(i) for i in range(pdfs)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as threads:
+        sizes = list(threads.map(lambda i: len(render(reports[i], f"bench-{i}")), range(pdfs)))
+    elapsed = time.perf_counter() - t0
+    return pdfs / elapsed, sum(sizes) / len(sizes)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    render_pdf_bytes(sample_report(0), "warmup")
+    per_sec, avg_size = run(render_pdf_bytes, args.pdfs, args.concurrency)
+    print(f"inline           {per_sec:>8.1f} PDFs/s  (avg {avg_size / 1024:.1f} KB)")
+
+    pool = PdfRenderPool(workers=args.workers, queue_size=args.concurrency)
+    pool.start()
+    try:
+        per_sec, _ = run(pool.render, args.pdfs, args.concurrency)
+        print(f"pool ({args.workers} procs)   {per_sec:>8.1f} PDFs/s")
+    finally:
+        pool.shutdown()
+
+if __name__ == "__main__":
+    main()
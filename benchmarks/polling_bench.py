@@ -0,0 +1,60 @@
+"""Requests/sec of the status-polling endpoints under concurrent clients.
+
+Start the API (e.g. `uvicorn main:app --workers 1`), then:
+
+    python -m benchmarks.polling_bench --url http://localhost:8000 --clients 50 --seconds 20
+
+Polls GET /report/{id} (for --report-id, or the newest report) and GET /reports/list
+the way dashboards do. Compare runs before/after changing DB_POOL_SIZE etc.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+async def poll(client: httpx.AsyncClient, paths, deadline: float, latencies: list, errors: list):
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            response = await client.get(path)
+            if response.status_code >= 500:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - t0)
+
+async def run(url: str, clients: int, seconds: float, report_id: str = None):
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        if report_id is None:
+            reports = (await client.get("/reports/list", params={"limit": 1})).json()["reports"]
+            report_id = reports[0]["report_id"] if reports else "missing"
+        paths = [f"/report/{report_id}", "/reports/list?limit=20"]
+
+        latencies, errors = [], []
+        deadline = time.perf_counter() + seconds
+        started = time.perf_counter()
+        await asyncio.gather(*[poll(client, paths, deadline, latencies, errors) for _ in range(clients)])
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"clients={clients} requests={len(latencies)} errors={len(errors)}")
+    print(f"throughput: {len(latencies) / elapsed:.1f} req/s")
+    print(f"latency ms: p50={p(0.50):.1f} p95={p(0.95):.1f} p99={p(0.99):.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--report-id", default=None)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.clients, args.seconds, args.report_id))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Recall/latency benchmark for Qdrant collection layouts.
+
+Runs against Qdrant's local in-memory mode by default (no server needed):
+
+    python -m benchmarks.qdrant_layout_bench --points 20000 --queries 200
+
+Local mode does exact search and ignores HNSW/quantization, so it validates the
+layout configs end to end; pass --host to measure real recall/latency on a server.
+"""
+import argparse
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct
+
+from services.qdrant_service import build_collection_config, build_search_params
+
+LAYOUTS = ["none", "scalar", "binary"]
+
+def make_client(host: str = None, port: int = 6333) -> QdrantClient:
+    if host:
+        return QdrantClient(host=host, port=port)
+    return QdrantClient(":memory:")
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    # Cosine ground truth on normalized vectors
+    scores = queries @ corpus.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def run_layout(client, layout, corpus, queries, truth, k, batch_size=1000):
+    name = f"bench_{layout}"
+    if any(c.name == name for c in client.get_collections().collections):
+        client.delete_collection(name)
+    client.create_collection(collection_name=name, **build_collection_config(corpus.shape[1], layout))
+
+    for start in range(0, len(corpus), batch_size):
+        chunk = corpus[start:start + batch_size]
+        client.upsert(
+            collection_name=name,
+            points=[
+                PointStruct(id=start + i, vector=vec.tolist())
+                for i, vec in enumerate(chunk)
+            ]
+        )
+
+    params = build_search_params(layout)
+    latencies = []
+    hits_found = 0
+    for qi, query in enumerate(queries):
+        t0 = time.perf_counter()
+        hits = client.search(collection_name=name, query_vector=query.tolist(), limit=k, search_params=params)
+        latencies.append(time.perf_counter() - t0)
+        hits_found += len(set(h.id for h in hits) & set(truth[qi].tolist()))
+
+    client.delete_collection(name)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "layout": layout,
+        "recall": hits_found / (len(queries) * k),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95))
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=6333)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus = rng.standard_normal((args.points, args.dim)).astype(np.float32)
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = exact_top_k(corpus, queries, args.k)
+
+    client = make_client(args.host, args.port)
+    print(f"{'layout':<8} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for layout in LAYOUTS:
+        r = run_layout(client, layout, corpus, queries, truth, args.k)
+        print(f"{r['layout']:<8} {r['recall']:>10.3f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
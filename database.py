@@ -1,12 +1,44 @@
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, Text, JSON
+from sqlalchemy import create_engine, Column, String, Integer, BigInteger, Float, DateTime, Text, JSON, Index, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 from config import settings
 
+def _pool_options(url: str) -> dict:
+    # SQLite uses a single-connection pool that rejects sizing arguments
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING
+    }
+
+def _async_url(url: str) -> str:
+    if settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    for sync_prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("sqlite://", "sqlite+aiosqlite://")
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
 # Database setup
-engine = create_engine(settings.DATABASE_URL)
+# Sync engine: workers, init_db and thread-offloaded maintenance
+engine = create_engine(settings.DATABASE_URL, **_pool_options(settings.DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine: API endpoints, so queries don't block the event loop
+async_database_url = _async_url(settings.DATABASE_URL)
+async_engine = create_async_engine(async_database_url, **_pool_options(async_database_url))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # Models
@@ -18,6 +50,35 @@ class UploadedFile(Base):
     file_name = Column(String)
     file_type = Column(String)  # 'csv' or 'image'
     storage_path = Column(String)
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 of the Blob this row points to
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Keyset pagination on (created_at, id), optionally within a file type
+    __table_args__ = (
+        Index("ix_uploaded_files_created_at_id", "created_at", "id"),
+        Index("ix_uploaded_files_type_created_at_id", "file_type", "created_at", "id"),
+    )
+
+class Blob(Base):
+    __tablename__ = "blobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64), unique=True, index=True)  # sha256 hex
+    storage_path = Column(String)
+    size_bytes = Column(BigInteger)
+    ref_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_referenced_at = Column(DateTime, default=datetime.utcnow)
+
+class PendingUpload(Base):
+    __tablename__ = "pending_uploads"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    upload_id = Column(String, unique=True, index=True)
+    s3_key = Column(String)  # incoming/ object the client uploads to via presigned POST
+    file_name = Column(String)
+    file_type = Column(String)
+    content_hash = Column(String(64), nullable=True)  # sha256 the client declared; S3 verifies it
     created_at = Column(DateTime, default=datetime.utcnow)
 
 class Report(Base):
@@ -26,14 +87,131 @@ class Report(Base):
     id = Column(Integer, primary_key=True, index=True)
     report_id = Column(String, unique=True, index=True)
     status = Column(String, default="pending")  # pending, processing, completed, failed
-    result = Column(JSON, nullable=True)
+    result = Column(JSON, nullable=True)  # NULL once archived to cold storage
     error_message = Column(Text, nullable=True)
+    job_id = Column(String, nullable=True)  # latest generation job; its payload holds the inputs
+    cache_key = Column(String(64), nullable=True, index=True)  # identical requests reuse this report
+    result_hash = Column(String(64), nullable=True)  # sha256 of the canonical result; PDF cache key and ETag
+    result_location = Column(String, nullable=True)  # storage path of the archived, zstd-compressed result
+    result_summary = Column(Text, nullable=True)  # summary kept in the table after archiving
+    archived_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)  # set once on completion; retention ages reports from here
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Keyset pagination on (created_at, id), optionally within a status
+    __table_args__ = (
+        Index("ix_reports_created_at_id", "created_at", "id"),
+        Index("ix_reports_status_created_at_id", "status", "created_at", "id"),
+    )
+
+class ReportStage(Base):
+    __tablename__ = "report_stages"
+    
+    # Checkpointed output of one pipeline stage (csv, vision, prompt, llm) of a report
+    id = Column(Integer, primary_key=True, index=True)
+    report_id = Column(String, index=True)
+    stage = Column(String)
+    status = Column(String)  # completed, failed
+    output = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    duration_seconds = Column(Float, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ux_report_stages_report_stage", "report_id", "stage", unique=True),
+    )
+
+class ReportMetric(Base):
+    __tablename__ = "report_metrics"
+    
+    # One row per key_metric of a completed report, written with the result so
+    # analytics queries hit indexes instead of scanning Report.result JSON
+    id = Column(Integer, primary_key=True, index=True)
+    report_id = Column(String, index=True)
+    name = Column(String)
+    name_key = Column(String)  # lowercased, whitespace-collapsed name used for matching
+    value_num = Column(Float, nullable=True)  # parsed numeric value, if any
+    value_text = Column(String, nullable=True)  # value as reported
+    unit = Column(String, nullable=True)
+    created_at = Column(DateTime)  # copied from the report
+    
+    __table_args__ = (
+        Index("ix_report_metrics_name_created_at_id", "name_key", "created_at", "id"),
+        Index("ix_report_metrics_name_value", "name_key", "value_num"),
+    )
+
+class ReportTrend(Base):
+    __tablename__ = "report_trends"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    report_id = Column(String, index=True)
+    description = Column(Text)
+    direction = Column(String)  # up, down, stable
+    impact = Column(String)  # positive, negative, neutral
+    created_at = Column(DateTime)  # copied from the report
+    
+    __table_args__ = (
+        Index("ix_report_trends_direction_impact_created_at", "direction", "impact", "created_at"),
+    )
+
+class Job(Base):
+    __tablename__ = "jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String, unique=True, index=True)
+    job_type = Column(String, index=True)  # e.g. 'report_generation'
+    payload = Column(JSON)
+    status = Column(String, default="queued", index=True)  # queued, running, completed, failed
+    priority = Column(Integer, default=0)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    locked_by = Column(String, nullable=True)  # worker id holding the job
+    heartbeat_at = Column(DateTime, nullable=True)
+    run_after = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 # Create tables
+SCHEMA_LOCK_KEY = 720145  # pg advisory lock id held while init_db migrates
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    # API and worker processes start together; on Postgres an advisory lock makes them
+    # apply schema changes one at a time (DDL is transactional there)
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        Base.metadata.create_all(bind=conn)
+        _add_missing_columns(conn)
+
+def _add_missing_columns(conn):
+    # create_all never alters existing tables; add new nullable columns in place
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            try:
+                with conn.begin_nested():
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                print(f"Added column {table.name}.{column.name}")
+            except (OperationalError, ProgrammingError) as e:
+                # Another process starting at the same time added it first (no lock on SQLite)
+                if "duplicate column" not in str(e) and "already exists" not in str(e):
+                    raise
+        for index in table.indexes:
+            try:
+                with conn.begin_nested():
+                    index.create(bind=conn, checkfirst=True)
+            except (OperationalError, ProgrammingError) as e:
+                if "already exists" not in str(e):
+                    raise
 
 # Dependency
 def get_db():
@@ -41,4 +219,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,65 @@
+import os
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+# Conditional and partial GETs for files we serve from disk. Only single
+# "bytes=" ranges are honoured; anything else gets the full file.
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if start == "":
+            # Suffix range: the last N bytes
+            suffix = int(end)
+            first, last = (max(size - suffix, 0) if suffix > 0 else size), size - 1
+        else:
+            first = int(start)
+            last = min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        return None
+    if first >= size or first > last:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return first, last
+
+def _iter_file(path: str, first: int, length: int, chunk_size: int = 64 * 1024):
+    with open(path, "rb") as f:
+        f.seek(first)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def file_response(request: Request, path: str, media_type: str, etag: str, headers: Dict[str, str] = None) -> Response:
+    headers = {**(headers or {}), "ETag": etag, "Accept-Ranges": "bytes"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # A stale If-Range means the client's partial copy is from another version
+    if_range = request.headers.get("if-range")
+    size = os.path.getsize(path)
+    byte_range = None
+    if if_range is None or if_range == etag:
+        byte_range = parse_range(request.headers.get("range"), size)
+
+    if byte_range is None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    first, last = byte_range
+    length = last - first + 1
+    headers.update({
+        "Content-Range": f"bytes {first}-{last}/{size}",
+        "Content-Length": str(length)
+    })
+    return StreamingResponse(_iter_file(path, first, length), status_code=206, media_type=media_type, headers=headers)
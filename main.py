@@ -1,23 +1,42 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, BackgroundTasks, Form
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy import select, update, func, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Tuple
 import uuid
 from datetime import datetime
-import tempfile
 import os
+import json
+import asyncio
+import threading
 from pathlib import Path
 
 from config import settings
-from database import get_db, init_db, UploadedFile, Report
+from database import (
+    get_async_db, init_db, SessionLocal, AsyncSessionLocal, async_engine,
+    UploadedFile, Report, PendingUpload, ReportMetric, ReportTrend, ReportStage, Job
+)
 from models import (
     FileUploadResponse, GenerateReportRequest, 
-    GenerateReportResponse, ReportResponse, ReportData
+    GenerateReportResponse, ReportResponse, ReportData,
+    PresignUploadRequest, PresignUploadResponse, BatchUploadResponse,
+    GenerateReportVariantsRequest, GenerateReportVariantsResponse, ReportVariant
 )
 from services.storage_service import StorageService
 from services.report_service import ReportService
-from services.pdf_service import PDFService
+from services.pdf_render_pool import pdf_render_pool
+from services.report_export import ReportExporter
+from services.report_checkpoints import ReportCheckpoints, STAGES
+from services.job_queue import JobQueue
+from services.report_events import report_events, TERMINAL_STATUSES
+from services.report_scheduler import report_scheduler, LaneFullError
+from services.report_analytics import ReportAnalytics, summary_rows
+from services.report_archive import ReportArchive
+from services.pdf_cache import PdfCache, result_hash
+from worker import Worker, build_handlers, REPORT_GENERATION
+from pagination import paginate, next_cursor
+from file_responses import file_response, etag_matches
 
 # Initialize FastAPI
 app = FastAPI(
@@ -35,9 +54,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Content-Length ceilings for upload routes, enforced before the multipart body is read.
+# The per-file limit in StorageService still applies to chunked or understated bodies.
+MULTIPART_OVERHEAD = 64 * 1024
+UPLOAD_BODY_LIMITS = {
+    "/upload/csv": settings.MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+    "/upload/image": settings.MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+    "/upload/batch": settings.MAX_UPLOAD_REQUEST_SIZE,
+    "/generate-report-instant": settings.MAX_UPLOAD_REQUEST_SIZE,
+    "/generate-report-instant-pdf": settings.MAX_UPLOAD_REQUEST_SIZE
+}
+
+class UploadSizeLimitMiddleware:
+    # Plain ASGI rather than @app.middleware: every other route (status polling, SSE,
+    # streaming export) passes straight through without an extra task or body stream
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is not None:
+            content_length = dict(scope["headers"]).get(b"content-length", b"")
+            if content_length.isdigit() and int(content_length) > limit:
+                response = JSONResponse(
+                    status_code=413,
+                    content={"detail": f"Request exceeds maximum upload size of {limit // (1024 * 1024)}MB"},
+                    headers={"Connection": "close"}
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+app.add_middleware(UploadSizeLimitMiddleware, limits=UPLOAD_BODY_LIMITS)
+
 # Initialize services
 storage_service = StorageService()
 report_service = ReportService()
+report_archive = ReportArchive(storage_service)
+pdf_cache = PdfCache(storage_service)
+report_exporter = ReportExporter(pdf_cache, report_archive)
 
 # Initialize database on startup
 @app.on_event("startup")
@@ -48,6 +104,32 @@ async def startup_event():
     print(" Powered by Google Gemini (FREE & Fast!)")
     print("=" * 60)
     print("Database initialized")
+    
+    # Fork the PDF render workers before any background threads exist
+    pdf_render_pool.start()
+    
+    # Status notifications for long-poll / SSE / WebSocket subscribers
+    report_events.bind_loop(asyncio.get_running_loop())
+    report_events.start_listener()
+    
+    # Collapse duplicate vectors left over from random point IDs without blocking startup
+    if settings.QDRANT_DEDUPE_ON_STARTUP:
+        threading.Thread(target=report_service.dedupe_report_embeddings, daemon=True).start()
+    
+    # Index metrics/trends of reports completed before the analytics tables existed
+    threading.Thread(target=_backfill_analytics, daemon=True).start()
+    
+    # Without separate worker processes, run the queue consumers in this process
+    if settings.RUN_EMBEDDED_WORKER:
+        Worker(build_handlers(report_service, storage_service)).start()
+    
+    # Precompute embeddings for the queries dashboards issue constantly
+    if settings.QUERY_WARMUP:
+        report_service.warmup_search(settings.QUERY_WARMUP)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    pdf_render_pool.shutdown()
 
 @app.get("/")
 async def root():
@@ -60,7 +142,7 @@ async def root():
         "features": [
             "Multi-step workflow (upload → generate → retrieve)",
             "Direct workflow (upload files → instant report)",
-            "Background processing",
+            "Durable background job queue",
             "Database storage",
             "Vector search",
             "PDF generation"
@@ -70,24 +152,25 @@ async def root():
 @app.post("/upload/csv", response_model=FileUploadResponse)
 async def upload_csv(
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Validate file extension
     if not any(file.filename.lower().endswith(ext) for ext in settings.ALLOWED_CSV_EXTENSIONS):
         raise HTTPException(status_code=400, detail="Invalid file type. Only CSV files allowed.")
     
     # Upload file
-    file_id, storage_path = await storage_service.upload_file(file, "csv")
+    file_id, storage_path, content_hash = await storage_service.upload_file(file, "csv", db)
     
     # Save metadata to database
     db_file = UploadedFile(
         file_id=file_id,
         file_name=file.filename,
         file_type="csv",
-        storage_path=storage_path
+        storage_path=storage_path,
+        content_hash=content_hash
     )
     db.add(db_file)
-    db.commit()
+    await db.commit()
     
     return FileUploadResponse(
         file_id=file_id,
@@ -99,7 +182,7 @@ async def upload_csv(
 @app.post("/upload/image", response_model=FileUploadResponse)
 async def upload_image(
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
 
     # Validate file extension
@@ -107,17 +190,18 @@ async def upload_image(
         raise HTTPException(status_code=400, detail="Invalid file type. Only image files allowed.")
     
     # Upload file
-    file_id, storage_path = await storage_service.upload_file(file, "image")
+    file_id, storage_path, content_hash = await storage_service.upload_file(file, "image", db)
     
     # Save metadata to database
     db_file = UploadedFile(
         file_id=file_id,
         file_name=file.filename,
         file_type="image",
-        storage_path=storage_path
+        storage_path=storage_path,
+        content_hash=content_hash
     )
     db.add(db_file)
-    db.commit()
+    await db.commit()
     
     return FileUploadResponse(
         file_id=file_id,
@@ -126,96 +210,259 @@ async def upload_image(
         message="Image file uploaded successfully"
     )
 
-def process_report_generation(
-    report_id: str,
-    csv_paths: List[str],
-    image_paths: List[str],
-    description: str,
-    db: Session
+@app.post("/upload/batch", response_model=BatchUploadResponse)
+async def upload_batch(
+    csv_files: List[UploadFile] = File(..., description="Upload one or more CSV files"),
+    image_files: List[UploadFile] = File(None, description="Upload images (optional)"),
+    create_report: bool = Form(False, description="Also start report generation for these files"),
+    description: str = Form("Generate a comprehensive business analytics report"),
+    use_cache: bool = Form(True, description="Reuse an identical earlier report; false always generates a fresh one"),
+    db: AsyncSession = Depends(get_async_db)
 ):
-
+    image_files = image_files or []
+    
+    # Validate every part before storing any of them
+    for f in csv_files:
+        if not any(f.filename.lower().endswith(ext) for ext in settings.ALLOWED_CSV_EXTENSIONS):
+            raise HTTPException(status_code=400, detail=f"Invalid file: {f.filename}. Only CSV files allowed.")
+    for f in image_files:
+        if not any(f.filename.lower().endswith(ext) for ext in settings.ALLOWED_IMAGE_EXTENSIONS):
+            raise HTTPException(status_code=400, detail=f"Invalid file: {f.filename}. Allowed: JPG, PNG, WEBP")
+    
+    parts = [(f, "csv") for f in csv_files] + [(f, "image") for f in image_files]
+    
+    # Stream all parts to storage concurrently, then insert every row in one transaction.
+    # Every upload finishes before any failure is handled: they share the session.
+    results = await asyncio.gather(*[
+        storage_service.upload_file(f, file_type, db) for f, file_type in parts
+    ], return_exceptions=True)
+    stored = [r for r in results if not isinstance(r, BaseException)]
+    
     try:
-        print(f"\n Processing report: {report_id}")
-        
-        # Update status to processing
-        report = db.query(Report).filter(Report.report_id == report_id).first()
-        report.status = "processing"
-        db.commit()
-        
-        # Generate report using Gemini
-        print("→ Generating report with Gemini AI...")
-        result = report_service.generate_report(csv_paths, image_paths, description)
+        failure = next((r for r in results if isinstance(r, BaseException)), None)
+        if failure is not None:
+            raise failure
+        db_files = [
+            UploadedFile(
+                file_id=file_id,
+                file_name=f.filename,
+                file_type=file_type,
+                storage_path=storage_path,
+                content_hash=content_hash
+            )
+            for (f, file_type), (file_id, storage_path, content_hash) in zip(parts, stored)
+        ]
+        db.add_all(db_files)
         
-        if result["success"]:
-            print("✓ Report generated successfully!")
-            
-            # Store embedding in Qdrant
-            print("→ Storing embeddings in Qdrant...")
-            report_service.store_report_embedding(report_id, result["data"])
-            
-            # Update database
-            report.status = "completed"
-            report.result = result["data"]
-            report.updated_at = datetime.utcnow()
-            db.commit()
-            print(f"✓ Report {report_id} completed and stored")
-        else:
-            print(f"✗ Report generation failed: {result.get('error')}")
-            report.status = "failed"
-            report.error_message = result.get("error", "Unknown error")
-            db.commit()
+        report_id = None
+        cached = None
+        if create_report:
+            csv_rows = [f for f in db_files if f.file_type == "csv"]
+            image_rows = [f for f in db_files if f.file_type == "image"]
+            # Same result cache as /generate-report: identical files and description reuse a report
+            cache_key = _report_cache_key(csv_rows, image_rows, description)
+            cached = await _find_cached_report(db, cache_key) if use_cache else None
+            if cached is not None:
+                report_id = cached.report_id
+            else:
+                await _admit_batch_job(db)
+                report_id = str(uuid.uuid4())
+                job = enqueue_report_generation(db, report_id, csv_rows, image_rows, description)
+                db.add(Report(report_id=report_id, status="pending", job_id=job.job_id, cache_key=cache_key))
+        await db.commit()
+    except BaseException:
+        # Nothing was committed; remove the blobs this batch wrote (e.g. after a 413)
+        await db.rollback()
+        await db.run_sync(storage_service.discard_uploads, [storage_path for _, storage_path, _ in stored])
+        raise
+    
+    return BatchUploadResponse(
+        files=[
+            FileUploadResponse(
+                file_id=f.file_id,
+                file_name=f.file_name,
+                file_type=f.file_type,
+                message="File uploaded successfully"
+            )
+            for f in db_files
+        ],
+        report_id=report_id,
+        message=f"Uploaded {len(db_files)} file(s)" + (
+            ". An identical report already exists." if cached is not None
+            else ". Report generation started." if report_id else ""
+        ),
+        cached=cached is not None
+    )
+
+@app.post("/upload/presign", response_model=PresignUploadResponse)
+async def presign_upload(request: PresignUploadRequest, db: AsyncSession = Depends(get_async_db)):
+    if settings.USE_LOCAL_STORAGE:
+        raise HTTPException(status_code=400, detail="Direct uploads require S3 storage")
+    
+    allowed = {
+        "csv": settings.ALLOWED_CSV_EXTENSIONS,
+        "image": settings.ALLOWED_IMAGE_EXTENSIONS
+    }.get(request.file_type)
+    if allowed is None:
+        raise HTTPException(status_code=400, detail="file_type must be 'csv' or 'image'")
+    if not any(request.file_name.lower().endswith(ext) for ext in allowed):
+        raise HTTPException(status_code=400, detail=f"Invalid file type for {request.file_type}")
+    
+    presigned = storage_service.create_presigned_upload(db, request.file_name, request.file_type, request.sha256)
+    await db.commit()
+    return PresignUploadResponse(**presigned)
+
+@app.post("/upload/presign/{upload_id}/complete", response_model=FileUploadResponse)
+async def complete_presigned_upload(upload_id: str, db: AsyncSession = Depends(get_async_db)):
+    pending = (await db.execute(
+        select(PendingUpload).where(PendingUpload.upload_id == upload_id)
+    )).scalars().first()
     
+    if not pending:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    
+    try:
+        file_id, storage_path, content_hash = await storage_service.complete_presigned_upload(db, pending)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"✗ Error processing report: {str(e)}")
-        report = db.query(Report).filter(Report.report_id == report_id).first()
-        report.status = "failed"
-        report.error_message = str(e)
-        db.commit()
+        raise HTTPException(status_code=400, detail=f"Upload not completed: {str(e)}")
+    
+    db.add(UploadedFile(
+        file_id=file_id,
+        file_name=pending.file_name,
+        file_type=pending.file_type,
+        storage_path=storage_path,
+        content_hash=content_hash
+    ))
+    await db.delete(pending)
+    await db.commit()
+    
+    return FileUploadResponse(
+        file_id=file_id,
+        file_name=pending.file_name,
+        file_type=pending.file_type,
+        message="File uploaded successfully"
+    )
+
+async def _admit_batch_job(db: AsyncSession):
+    # Queue-depth cap for the batch lane: reject instead of letting the backlog grow unbounded
+    queued = await db.scalar(
+        select(func.count()).select_from(Job).where(Job.job_type == REPORT_GENERATION, Job.status == "queued")
+    )
+    if queued >= settings.REPORT_LANE_QUEUE_SIZE["batch"]:
+        raise LaneFullError("batch", report_scheduler.retry_after("batch", queued))
+
+async def _queue_position(db: AsyncSession, report: Report) -> Optional[int]:
+    # 1-based position of the report's job among queued jobs, in the order workers claim them
+    if report.status != "pending" or not report.job_id:
+        return None
+    job = (await db.execute(select(Job).where(Job.job_id == report.job_id))).scalars().first()
+    if job is None or job.status != "queued":
+        return None
+    ahead = await db.scalar(
+        select(func.count()).select_from(Job).where(
+            Job.job_type == job.job_type,
+            Job.status == "queued",
+            or_(Job.priority > job.priority, and_(Job.priority == job.priority, Job.id < job.id))
+        )
+    )
+    return ahead + 1
+
+def enqueue_report_generation(
+    db: AsyncSession,
+    report_id: str,
+    csv_files: List[UploadedFile],
+    image_files: List[UploadedFile],
+    description: str,
+    tags: Optional[List[str]] = None
+) -> Job:
+    # Workers resolve storage paths themselves, so jobs stay valid across hosts and restarts
+    return JobQueue.enqueue(db, REPORT_GENERATION, {
+        "report_id": report_id,
+        "csv_storage_paths": [f.storage_path for f in csv_files],
+        "image_storage_paths": [f.storage_path for f in image_files],
+        "description": description,
+        "tags": tags or []
+    })
+
+async def _load_report_files(
+    db: AsyncSession,
+    csv_file_ids: List[str],
+    image_file_ids: List[str]
+) -> Tuple[List[UploadedFile], List[UploadedFile]]:
+    # Returned in request order, which is the order the prompt numbers them in
+    rows = (await db.execute(
+        select(UploadedFile).where(UploadedFile.file_id.in_(csv_file_ids + image_file_ids))
+    )).scalars().all()
+    by_id = {f.file_id: f for f in rows}
+    csv_files = [by_id[i] for i in csv_file_ids if i in by_id]
+    image_files = [by_id[i] for i in image_file_ids if i in by_id]
+    
+    if len(csv_files) != len(csv_file_ids):
+        raise HTTPException(status_code=404, detail="Some CSV files not found")
+    
+    # if len(image_files) != len(image_file_ids):
+    #     raise HTTPException(status_code=404, detail="Some image files not found")
+    
+    return csv_files, image_files
+
+def _report_cache_key(csv_files: List[UploadedFile], image_files: List[UploadedFile], description: Optional[str]) -> Optional[str]:
+    # Files uploaded before content hashing can't be keyed
+    if any(f.content_hash is None for f in csv_files + image_files):
+        return None
+    return report_service.cache_key(
+        [f.content_hash for f in csv_files],
+        [f.content_hash for f in image_files],
+        description
+    )
+
+async def _find_cached_report(db: AsyncSession, cache_key: Optional[str]) -> Optional[Report]:
+    # Newest completed report for the key, else an identical request still in flight
+    if cache_key is None:
+        return None
+    reports = (await db.execute(
+        select(Report)
+        .where(Report.cache_key == cache_key, Report.status.in_(("completed", "pending", "processing")))
+        .order_by(Report.created_at.desc())
+        .limit(10)
+    )).scalars().all()
+    return next((r for r in reports if r.status == "completed"), reports[0] if reports else None)
 
 @app.post("/generate-report", response_model=GenerateReportResponse)
 async def generate_report(
     request: GenerateReportRequest,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
 
     # Validate file IDs exist
-    csv_files = db.query(UploadedFile).filter(
-        UploadedFile.file_id.in_(request.csv_file_ids)
-    ).all()
+    csv_files, image_files = await _load_report_files(db, request.csv_file_ids, request.image_file_ids)
     
-    image_files = db.query(UploadedFile).filter(
-        UploadedFile.file_id.in_(request.image_file_ids)
-    ).all()
-    
-    if len(csv_files) != len(request.csv_file_ids):
-        raise HTTPException(status_code=404, detail="Some CSV files not found")
+    # Identical inputs, description and model/prompt version: reuse the existing report
+    cache_key = _report_cache_key(csv_files, image_files, request.description)
+    if request.use_cache:
+        cached = await _find_cached_report(db, cache_key)
+        if cached is not None:
+            return GenerateReportResponse(
+                report_id=cached.report_id,
+                message="An identical report already exists. Use GET /report/{report_id} to fetch it.",
+                status=cached.status,
+                cached=True
+            )
     
-    # if len(image_files) != len(request.image_file_ids):
-    #     raise HTTPException(status_code=404, detail="Some image files not found")
+    await _admit_batch_job(db)
     
-    # Create report record
+    # Create report record and its job in one transaction
     report_id = str(uuid.uuid4())
     report = Report(
         report_id=report_id,
-        status="pending"
+        status="pending",
+        cache_key=cache_key
     )
     db.add(report)
-    db.commit()
-    
-    # Get file paths
-    csv_paths = [storage_service.get_file_path(f.storage_path) for f in csv_files]
-    image_paths = [storage_service.get_file_path(f.storage_path) for f in image_files]
-    
-    # Add background task
-    background_tasks.add_task(
-        process_report_generation,
-        report_id,
-        csv_paths,
-        image_paths,
-        request.description,
-        db
-    )
+    job = enqueue_report_generation(db, report_id, csv_files, image_files, request.description, request.tags)
+    report.job_id = job.job_id
+    await db.commit()
     
     return GenerateReportResponse(
         report_id=report_id,
@@ -223,31 +470,252 @@ async def generate_report(
         status="pending"
     )
 
-@app.get("/report/{report_id}", response_model=ReportResponse)
-async def get_report(report_id: str, db: Session = Depends(get_db)):
-    report = db.query(Report).filter(Report.report_id == report_id).first()
+@app.post("/generate-report/variants", response_model=GenerateReportVariantsResponse)
+async def generate_report_variants(
+    request: GenerateReportVariantsRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # One Report per description, all from one job: CSV and vision analysis run once
+    # and the LLM calls for the variants run concurrently
+    if not request.descriptions or len(request.descriptions) > settings.MAX_REPORT_VARIANTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Provide between 1 and {settings.MAX_REPORT_VARIANTS} descriptions"
+        )
     
+    csv_files, image_files = await _load_report_files(db, request.csv_file_ids, request.image_file_ids)
+    
+    variants = []
+    new_reports = []
+    for description in request.descriptions:
+        cache_key = _report_cache_key(csv_files, image_files, description)
+        cached = await _find_cached_report(db, cache_key) if request.use_cache else None
+        if cached is not None:
+            variants.append(ReportVariant(report_id=cached.report_id, description=description, status=cached.status, cached=True))
+            continue
+        report = Report(report_id=str(uuid.uuid4()), status="pending", cache_key=cache_key)
+        variants.append(ReportVariant(report_id=report.report_id, description=description))
+        new_reports.append((report, description))
+    
+    if new_reports:
+        await _admit_batch_job(db)
+        job = JobQueue.enqueue(db, REPORT_GENERATION, {
+            "report_ids": [r.report_id for r, _ in new_reports],
+            "descriptions": [d for _, d in new_reports],
+            "csv_storage_paths": [f.storage_path for f in csv_files],
+            "image_storage_paths": [f.storage_path for f in image_files],
+            "tags": request.tags
+        })
+        for report, _ in new_reports:
+            report.job_id = job.job_id
+            db.add(report)
+        await db.commit()
+    
+    return GenerateReportVariantsResponse(
+        reports=variants,
+        message="Report generation started. Use GET /report/{report_id} to check each variant.",
+        # The least advanced of the returned reports: only "completed" when all of them are
+        status=min((v.status for v in variants), key=("pending", "processing", "completed").index)
+    )
+
+@app.delete("/reports/cache/{report_id}")
+async def invalidate_cached_report(report_id: str, db: AsyncSession = Depends(get_async_db)):
+    # The report stays; identical requests just stop being answered with it
+    result = await db.execute(update(Report).where(Report.report_id == report_id).values(cache_key=None))
+    await db.commit()
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return {"report_id": report_id, "invalidated": True}
+
+@app.delete("/reports/cache")
+async def invalidate_report_cache(db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(update(Report).where(Report.cache_key.isnot(None)).values(cache_key=None))
+    await db.commit()
+    return {"invalidated_reports": result.rowcount}
+
+@app.post("/report/{report_id}/retry", response_model=GenerateReportResponse)
+async def retry_report(
+    report_id: str,
+    from_stage: Optional[str] = Query(None, description="Also redo this stage and everything after it: csv, vision, prompt or llm"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Re-enqueues the original job; the worker reuses every checkpointed stage, so only
+    # the failed stage (or from_stage) and the stages after it run again
+    report = (await db.execute(select(Report).where(Report.report_id == report_id))).scalars().first()
     if not report:
         raise HTTPException(status_code=404, detail="Report not found")
+    if from_stage is not None and from_stage not in STAGES:
+        raise HTTPException(status_code=400, detail=f"from_stage must be one of {', '.join(STAGES)}")
+    if report.status in ("pending", "processing"):
+        raise HTTPException(status_code=409, detail=f"Report is already {report.status}")
+    if report.status == "completed" and from_stage is None:
+        raise HTTPException(status_code=400, detail="Report is completed; pass from_stage to regenerate it")
+    
+    job = (await db.execute(select(Job).where(Job.job_id == report.job_id))).scalars().first() if report.job_id else None
+    if job is None:
+        raise HTTPException(status_code=409, detail="Original job inputs are not available for this report")
+    
+    await _admit_batch_job(db)
+    if from_stage is not None:
+        await db.run_sync(ReportCheckpoints.reset, report_id, from_stage)
+    payload = dict(job.payload)
+    if "report_ids" in payload:
+        # A variants job: retry only this report, not the siblings sharing the job
+        description = payload.pop("descriptions")[payload.pop("report_ids").index(report_id)]
+        payload.update(report_id=report_id, description=description)
+    new_job = JobQueue.enqueue(db, REPORT_GENERATION, payload)
+    report.job_id = new_job.job_id
+    report.status = "pending"
+    report.error_message = None
+    await db.commit()
+    
+    return GenerateReportResponse(
+        report_id=report_id,
+        message="Report generation resumed. Completed stages are reused.",
+        status="pending"
+    )
+
+@app.get("/report/{report_id}/stages")
+async def get_report_stages(report_id: str, include_output: bool = False, db: AsyncSession = Depends(get_async_db)):
+    rows = (await db.execute(select(ReportStage).where(ReportStage.report_id == report_id))).scalars().all()
+    by_stage = {row.stage: row for row in rows}
     
+    stages = []
+    for stage in STAGES:
+        row = by_stage.get(stage)
+        entry = {
+            "stage": stage,
+            "status": row.status if row else "not_run",
+            "attempts": row.attempts if row else 0,
+            "duration_seconds": row.duration_seconds if row else None,
+            "error": row.error if row else None,
+            "updated_at": row.updated_at if row else None
+        }
+        if include_output:
+            entry["output"] = row.output if row else None
+        stages.append(entry)
+    
+    return {"report_id": report_id, "stages": stages}
+
+async def _load_report(db: AsyncSession, report_id: str) -> Optional[Report]:
+    report = (await db.execute(select(Report).where(Report.report_id == report_id))).scalars().first()
+    # Detach, then end the transaction so waiting callers don't pin a pooled
+    # connection (rollback would otherwise expire the loaded attributes)
+    if report is not None:
+        db.expunge(report)
+    await db.rollback()
+    return report
+
+async def _report_result(report: Report) -> Optional[dict]:
+    # Archived results are fetched back from cold storage off the event loop
+    if report.status != "completed":
+        return None
+    if report.result is not None or not report.result_location:
+        return report.result
+    try:
+        return await asyncio.to_thread(report_archive.load_result, report)
+    except Exception as e:
+        print(f"Error loading archived result for {report.report_id}: {e}")
+        raise HTTPException(status_code=503, detail="Archived report result is unavailable")
+
+async def _report_response(report: Report, queue_position: Optional[int] = None) -> ReportResponse:
     # Convert result to ReportData if completed
     data = None
-    if report.status == "completed" and report.result:
-        data = ReportData(**report.result)
+    result = await _report_result(report)
+    if result:
+        data = ReportData(**result)
     
     return ReportResponse(
         report_id=report.report_id,
         status=report.status,
         data=data,
         error_message=report.error_message,
+        queue_position=queue_position,
         created_at=report.created_at,
         updated_at=report.updated_at
     )
 
+@app.get("/report/{report_id}", response_model=ReportResponse)
+async def get_report(
+    report_id: str,
+    wait: float = Query(0, ge=0, le=60, description="Long-poll: seconds to wait for a status change"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Subscribe before reading so a change between the read and the wait isn't missed
+    events = report_events.subscribe(report_id) if wait else None
+    try:
+        report = await _load_report(db, report_id)
+        
+        if not report:
+            raise HTTPException(status_code=404, detail="Report not found")
+        
+        if events is not None and report.status not in TERMINAL_STATUSES:
+            try:
+                await asyncio.wait_for(events.get(), timeout=wait)
+                report = await _load_report(db, report_id)
+            except asyncio.TimeoutError:
+                pass
+        
+        return await _report_response(report, await _queue_position(db, report))
+    finally:
+        if events is not None:
+            report_events.unsubscribe(report_id, events)
+
+async def _status_stream(report_id: str):
+    # Yields the current status, then each change, until the report is terminal.
+    # None is yielded periodically as a keepalive.
+    events = report_events.subscribe(report_id)
+    try:
+        async with AsyncSessionLocal() as db:
+            report = await _load_report(db, report_id)
+        if report is None:
+            yield {"report_id": report_id, "status": "not_found"}
+            return
+        
+        status = report.status
+        yield {"report_id": report_id, "status": status}
+        while status not in TERMINAL_STATUSES:
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=15)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if event["status"] != status:
+                status = event["status"]
+                yield event
+    finally:
+        report_events.unsubscribe(report_id, events)
+
+@app.get("/report/{report_id}/events")
+async def report_events_stream(report_id: str):
+    async def sse():
+        async for event in _status_stream(report_id):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: status\ndata: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(
+        sse(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/ws/report/{report_id}")
+async def report_events_websocket(websocket: WebSocket, report_id: str):
+    await websocket.accept()
+    try:
+        async for event in _status_stream(report_id):
+            if event is not None:
+                await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
 @app.get("/report/{report_id}/pdf")
-async def get_report_pdf(report_id: str, db: Session = Depends(get_db)):
+async def get_report_pdf(report_id: str, request: Request, db: AsyncSession = Depends(get_async_db)):
 
-    report = db.query(Report).filter(Report.report_id == report_id).first()
+    report = (await db.execute(select(Report).where(Report.report_id == report_id))).scalars().first()
     
     if not report:
         raise HTTPException(status_code=404, detail="Report not found")
@@ -255,21 +723,85 @@ async def get_report_pdf(report_id: str, db: Session = Depends(get_db)):
     if report.status != "completed":
         raise HTTPException(status_code=400, detail=f"Report not ready yet. Status: {report.status}")
     
-    # Generate PDF
-    pdf_buffer = PDFService.generate_report_pdf(report.result, report_id)
+    # Reports completed before result_hash existed get it filled in once
+    if report.result_hash is None:
+        report.result_hash = result_hash(await _report_result(report))
+        await db.commit()
     
-    return StreamingResponse(
-        pdf_buffer,
+    etag = f'"{report.result_hash}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    # Repeat downloads are a file read; render (and cache) only on the first one
+    pdf_path = await asyncio.to_thread(pdf_cache.get_path, report_id, report.result_hash)
+    if pdf_path is None:
+        result = await _report_result(report)
+        pdf_path = await asyncio.to_thread(pdf_cache.render, report_id, result, report.result_hash)
+    
+    return file_response(
+        request,
+        pdf_path,
         media_type="application/pdf",
+        etag=etag,
         headers={"Content-Disposition": f"attachment; filename=report_{report_id}.pdf"}
     )
 
 @app.get("/reports/search")
-async def search_reports(query: str, limit: int = 5):
-
-    results = report_service.search_similar_reports(query, limit)
+async def search_reports(
+    query: str,
+    limit: int = 5,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    status: Optional[str] = None,
+    metric: Optional[List[str]] = Query(None, description="Match reports with any of these metric names"),
+    tag: Optional[List[str]] = Query(None, description="Match reports with any of these tags"),
+    hydrate: bool = False,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Status changes after a report is embedded (e.g. a retry), so it is checked against
+    # the database rather than the vector payload; over-fetch to fill the page after that
+    filters = {
+        "created_after": created_after,
+        "created_before": created_before,
+        "metric_names": metric,
+        "tags": tag
+    }
+    results = report_service.search_similar_reports(query, limit * 3 if status else limit, filters)
+    
+    if (hydrate or status) and results:
+        # One IN query for every hit instead of a GET /report/{id} per result
+        report_ids = [r["report_id"] for r in results]
+        reports = (await db.execute(select(Report).where(Report.report_id.in_(report_ids)))).scalars().all()
+        by_id = {r.report_id: r for r in reports}
+        if status:
+            results = [r for r in results if r["report_id"] in by_id and by_id[r["report_id"]].status == status][:limit]
+        if hydrate:
+            for r in results:
+                report = by_id.get(r["report_id"])
+                r["report"] = None if report is None else {
+                    "status": report.status,
+                    "data": await _report_result(report),
+                    "error_message": report.error_message,
+                    "created_at": report.created_at,
+                    "updated_at": report.updated_at
+                }
+    
     return {"query": query, "results": results, "count": len(results)}
 
+@app.get("/reports/search/cache")
+async def search_cache_stats():
+    return report_service.search_cache_stats()
+
+async def _generate_interactive(**kwargs):
+    # Interactive lane: ahead of queued jobs, 429 if the lane is full or the wait runs out.
+    # Waiting happens on the event loop; a thread is only taken once admitted.
+    async with report_scheduler.admit("interactive", timeout=settings.REPORT_INTERACTIVE_WAIT_SECONDS):
+        return await asyncio.to_thread(report_service.generate_report, **kwargs)
+
+@app.get("/reports/scheduler")
+async def scheduler_stats():
+    return report_scheduler.stats()
+
 @app.post("/generate-report-instant")
 async def generate_report_instant(
     csv_files: List[UploadFile] = File(..., description="Upload one or more CSV files"),
@@ -291,11 +823,7 @@ async def generate_report_instant(
                     detail=f"Invalid file: {csv_file.filename}. Only .csv files allowed."
                 )
             
-            temp_file = tempfile.NamedTemporaryFile(mode='wb', suffix='.csv', delete=False)
-            content = await csv_file.read()
-            temp_file.write(content)
-            temp_file.close()
-            temp_csv_paths.append(temp_file.name)
+            temp_csv_paths.append(await storage_service.save_temp_file(csv_file, '.csv'))
             print(f"  ✓ Saved: {csv_file.filename}")
         
         # Save image files temporarily (if provided)
@@ -309,16 +837,12 @@ async def generate_report_instant(
                     )
                 
                 suffix = Path(image_file.filename).suffix
-                temp_file = tempfile.NamedTemporaryFile(mode='wb', suffix=suffix, delete=False)
-                content = await image_file.read()
-                temp_file.write(content)
-                temp_file.close()
-                temp_image_paths.append(temp_file.name)
+                temp_image_paths.append(await storage_service.save_temp_file(image_file, suffix))
                 print(f"  ✓ Saved: {image_file.filename}")
         
         # Generate report using Gemini
         print("🤖 Processing with Gemini AI...")
-        result = report_service.generate_report(
+        result = await _generate_interactive(
             csv_file_paths=temp_csv_paths,
             image_file_paths=temp_image_paths,
             description=description
@@ -368,11 +892,7 @@ async def generate_report_instant_pdf(
             if not csv_file.filename.endswith('.csv'):
                 raise HTTPException(status_code=400, detail=f"Invalid file: {csv_file.filename}")
             
-            temp_file = tempfile.NamedTemporaryFile(mode='wb', suffix='.csv', delete=False)
-            content = await csv_file.read()
-            temp_file.write(content)
-            temp_file.close()
-            temp_csv_paths.append(temp_file.name)
+            temp_csv_paths.append(await storage_service.save_temp_file(csv_file, '.csv'))
         
         # Save image files temporarily
         if image_files:
@@ -382,14 +902,10 @@ async def generate_report_instant_pdf(
                     raise HTTPException(status_code=400, detail=f"Invalid image: {image_file.filename}")
                 
                 suffix = Path(image_file.filename).suffix
-                temp_file = tempfile.NamedTemporaryFile(mode='wb', suffix=suffix, delete=False)
-                content = await image_file.read()
-                temp_file.write(content)
-                temp_file.close()
-                temp_image_paths.append(temp_file.name)
+                temp_image_paths.append(await storage_service.save_temp_file(image_file, suffix))
         
         # Generate report
-        result = report_service.generate_report(
+        result = await _generate_interactive(
             csv_file_paths=temp_csv_paths,
             image_file_paths=temp_image_paths,
             description=description
@@ -399,10 +915,10 @@ async def generate_report_instant_pdf(
             raise HTTPException(status_code=500, detail=result.get('error'))
         
         # Generate PDF
-        pdf_buffer = PDFService.generate_report_pdf(result["data"], "instant-report")
+        pdf_bytes = await asyncio.to_thread(pdf_render_pool.render, result["data"], "instant-report")
         
-        return StreamingResponse(
-            pdf_buffer,
+        return Response(
+            pdf_bytes,
             media_type="application/pdf",
             headers={"Content-Disposition": "attachment; filename=business_report.pdf"}
         )
@@ -425,16 +941,24 @@ async def generate_report_instant_pdf(
 @app.get("/files/list")
 async def list_files(
     file_type: Optional[str] = None,
-    limit: int = 50,
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-
-    query = db.query(UploadedFile)
+    # Select only the listed columns
+    query = select(
+        UploadedFile.id,
+        UploadedFile.file_id,
+        UploadedFile.file_name,
+        UploadedFile.file_type,
+        UploadedFile.created_at
+    )
     
     if file_type:
-        query = query.filter(UploadedFile.file_type == file_type)
+        query = query.where(UploadedFile.file_type == file_type)
     
-    files = query.order_by(UploadedFile.created_at.desc()).limit(limit).all()
+    rows = (await db.execute(paginate(query, UploadedFile, cursor, limit))).all()
+    files = rows[:limit]
     
     return {
         "files": [
@@ -446,21 +970,225 @@ async def list_files(
             }
             for f in files
         ],
-        "count": len(files)
+        "count": len(files),
+        "next_cursor": next_cursor(rows, limit)
+    }
+
+@app.delete("/files/{file_id}")
+async def delete_file(file_id: str, db: AsyncSession = Depends(get_async_db)):
+    db_file = (await db.execute(
+        select(UploadedFile).where(UploadedFile.file_id == file_id)
+    )).scalars().first()
+    
+    if not db_file:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    await db.run_sync(storage_service.release_file, db_file)
+    await db.delete(db_file)
+    await db.commit()
+    
+    return {"file_id": file_id, "message": "File deleted"}
+
+@app.get("/storage/cache")
+async def storage_cache_stats():
+    return storage_service.cache_stats()
+
+def _collect_storage_garbage() -> int:
+    db = SessionLocal()
+    try:
+        return storage_service.collect_garbage(db)
+    finally:
+        db.close()
+
+@app.post("/storage/gc")
+async def collect_storage_garbage():
+    # Deletes objects from storage one by one; keep it off the event loop
+    removed = await asyncio.to_thread(_collect_storage_garbage)
+    return {"removed_blobs": removed}
+
+def _backfill_analytics():
+    db = SessionLocal()
+    try:
+        indexed = ReportAnalytics.backfill(db)
+        if indexed:
+            print(f"Indexed analytics for {indexed} existing report(s)")
+    except Exception as e:
+        print(f"Warning: analytics backfill failed: {e}")
+    finally:
+        db.close()
+
+def _summary_query(build, bucket: Optional[str], **filters):
+    try:
+        return build(async_engine.dialect.name, bucket, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analytics/metrics")
+async def query_metrics(
+    name: List[str] = Query([], description="Metric names (case-insensitive); repeat for several"),
+    min_value: Optional[float] = None,
+    max_value: Optional[float] = None,
+    unit: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # e.g. ?name=revenue growth&max_value=0&created_after=2024-07-01&created_before=2024-10-01
+    query = ReportAnalytics.filter_metrics(
+        select(
+            ReportMetric.id, ReportMetric.report_id, ReportMetric.name, ReportMetric.value_text,
+            ReportMetric.value_num, ReportMetric.unit, ReportMetric.created_at
+        ),
+        names=name, min_value=min_value, max_value=max_value, unit=unit,
+        created_after=created_after, created_before=created_before
+    )
+    rows = (await db.execute(paginate(query, ReportMetric, cursor, limit))).all()
+    metrics = rows[:limit]
+    
+    return {
+        "metrics": [
+            {
+                "report_id": m.report_id,
+                "name": m.name,
+                "value": m.value_text,
+                "value_num": m.value_num,
+                "unit": m.unit,
+                "created_at": m.created_at
+            }
+            for m in metrics
+        ],
+        "count": len(metrics),
+        "next_cursor": next_cursor(rows, limit)
+    }
+
+@app.get("/analytics/metrics/summary")
+async def summarize_metrics(
+    name: List[str] = Query([]),
+    min_value: Optional[float] = None,
+    max_value: Optional[float] = None,
+    unit: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    bucket: Optional[str] = Query(None, description="Group by time: day, week, month, quarter or year"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # count/min/max/avg per metric name (and time bucket), computed in the database
+    query = _summary_query(
+        ReportAnalytics.metric_summary_query, bucket,
+        names=name, min_value=min_value, max_value=max_value, unit=unit,
+        created_after=created_after, created_before=created_before
+    )
+    return {"metrics": summary_rows(await db.execute(query))}
+
+@app.get("/analytics/trends")
+async def query_trends(
+    direction: Optional[str] = None,
+    impact: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    query = ReportAnalytics.filter_trends(
+        select(
+            ReportTrend.id, ReportTrend.report_id, ReportTrend.description,
+            ReportTrend.direction, ReportTrend.impact, ReportTrend.created_at
+        ),
+        direction=direction, impact=impact, created_after=created_after, created_before=created_before
+    )
+    rows = (await db.execute(paginate(query, ReportTrend, cursor, limit))).all()
+    trends = rows[:limit]
+    
+    return {
+        "trends": [
+            {
+                "report_id": t.report_id,
+                "description": t.description,
+                "direction": t.direction,
+                "impact": t.impact,
+                "created_at": t.created_at
+            }
+            for t in trends
+        ],
+        "count": len(trends),
+        "next_cursor": next_cursor(rows, limit)
     }
 
+@app.get("/analytics/trends/summary")
+async def summarize_trends(
+    direction: Optional[str] = None,
+    impact: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    bucket: Optional[str] = Query(None, description="Group by time: day, week, month, quarter or year"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    query = _summary_query(
+        ReportAnalytics.trend_summary_query, bucket,
+        direction=direction, impact=impact, created_after=created_after, created_before=created_before
+    )
+    return {"trends": summary_rows(await db.execute(query))}
+
+def _archive_old_reports(older_than_days: Optional[int]) -> int:
+    db = SessionLocal()
+    try:
+        return report_archive.run_retention(db, older_than_days)
+    finally:
+        db.close()
+
+@app.post("/reports/archive")
+async def archive_old_reports(older_than_days: Optional[int] = Query(None, ge=0)):
+    # Retention job: compress old results into storage; also runnable as
+    # `python -m services.report_archive` from cron
+    archived = await asyncio.to_thread(_archive_old_reports, older_than_days)
+    return {"archived_reports": archived}
+
+@app.get("/reports/export")
+async def export_reports(
+    format: str = Query("zip", pattern="^(zip|ndjson)$"),
+    status: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    report_id: List[str] = Query([], description="Export only these reports; repeat for several")
+):
+    # Streams as it goes: reports are read in batches and never held all at once
+    filters = {"created_after": created_after, "created_before": created_before, "report_ids": report_id}
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    
+    if format == "ndjson":
+        return StreamingResponse(
+            report_exporter.ndjson(status=status, **filters),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": f"attachment; filename=reports_{stamp}.ndjson"}
+        )
+    
+    # Only completed reports have a PDF
+    if status and status != "completed":
+        raise HTTPException(status_code=400, detail="ZIP export only includes completed reports")
+    return StreamingResponse(
+        report_exporter.zip(**filters),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=reports_{stamp}.zip"}
+    )
+
 @app.get("/reports/list")
 async def list_reports(
     status: Optional[str] = None,
-    limit: int = 50,
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    query = db.query(Report)
+    # Select only the listed columns; never load the result JSON here
+    query = select(Report.id, Report.report_id, Report.status, Report.created_at, Report.updated_at)
     
     if status:
-        query = query.filter(Report.status == status)
+        query = query.where(Report.status == status)
     
-    reports = query.order_by(Report.created_at.desc()).limit(limit).all()
+    rows = (await db.execute(paginate(query, Report, cursor, limit))).all()
+    reports = rows[:limit]
     
     return {
         "reports": [
@@ -472,7 +1200,8 @@ async def list_reports(
             }
             for r in reports
         ],
-        "count": len(reports)
+        "count": len(reports),
+        "next_cursor": next_cursor(rows, limit)
     }
 
 if __name__ == "__main__":
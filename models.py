@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
@@ -9,10 +9,36 @@ class FileUploadResponse(BaseModel):
     file_type: str
     message: str
 
+class BatchUploadResponse(BaseModel):
+    files: List[FileUploadResponse]
+    report_id: Optional[str] = None
+    message: str
+    cached: bool = False  # True when report_id is an identical earlier request's report
+
+class PresignUploadRequest(BaseModel):
+    file_name: str
+    file_type: str  # 'csv' or 'image'
+    sha256: str = Field(..., pattern="^[0-9a-fA-F]{64}$")  # hex digest of the file; S3 rejects mismatching bytes
+
+class PresignUploadResponse(BaseModel):
+    upload_id: str
+    url: str
+    fields: Dict[str, str]
+    expires_in: int
+
 class GenerateReportRequest(BaseModel):
     csv_file_ids: List[str]
     image_file_ids: List[str]
     description: Optional[str] = "Generate a comprehensive business analytics report"
+    tags: List[str] = []  # Searchable labels stored with the report embedding
+    use_cache: bool = True  # False always generates a fresh report
+
+class GenerateReportVariantsRequest(BaseModel):
+    csv_file_ids: List[str]
+    image_file_ids: List[str]
+    descriptions: List[str]  # one report per description; CSV/image analysis is shared
+    tags: List[str] = []
+    use_cache: bool = True
 
 # Response Models
 class KeyMetric(BaseModel):
@@ -44,10 +70,23 @@ class ReportResponse(BaseModel):
     status: str
     data: Optional[ReportData] = None
     error_message: Optional[str] = None
+    queue_position: Optional[int] = None  # Set while the report's job waits in the queue
     created_at: datetime
     updated_at: datetime
 
 class GenerateReportResponse(BaseModel):
     report_id: str
     message: str
+    status: str
+    cached: bool = False  # True when an identical earlier request's report was returned
+
+class ReportVariant(BaseModel):
+    report_id: str
+    description: str
+    status: str = "pending"
+    cached: bool = False
+
+class GenerateReportVariantsResponse(BaseModel):
+    reports: List[ReportVariant]
+    message: str
     status: str
\ No newline at end of file
@@ -1,6 +1,24 @@
 import pandas as pd
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Callable
 import json
+import math
+
+def _json_safe(value: Any) -> Any:
+    # Analyses are stored in JSON columns: Postgres rejects NaN/inf, and numpy scalars
+    # or timestamps aren't JSON at all. Blank cells and single-row std() produce NaN.
+    if isinstance(value, dict):
+        return {str(k): _json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):
+        value = value.item()  # numpy scalar -> Python
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if value is pd.NaT:
+        return None
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
 
 class CSVService:
     @staticmethod
@@ -36,12 +54,15 @@ class CSVService:
                 "max": float(df[col].max()) if not df[col].isnull().all() else None,
             }
         
-        return analysis
+        return _json_safe(analysis)
     
     @staticmethod
-    def analyze_multiple_csvs(file_paths: List[str]) -> List[Dict[str, Any]]:
+    def analyze_multiple_csvs(file_paths: List[str], should_stop: Optional[Callable[[], bool]] = None) -> List[Dict[str, Any]]:
         results = []
         for idx, path in enumerate(file_paths):
+            # Cooperative cancellation between files
+            if should_stop is not None and should_stop():
+                break
             try:
                 analysis = CSVService.analyze_csv(path)
                 analysis["csv_index"] = idx
@@ -71,7 +92,12 @@ class CSVService:
             if result['numeric_summary']:
                 part += "\nNumeric Statistics:\n"
                 for col, stats in result['numeric_summary'].items():
-                    part += f"  {col}: mean={stats['mean']:.2f}, min={stats['min']:.2f}, max={stats['max']:.2f}\n"
+                    # None where a column has no finite values
+                    values = ", ".join(
+                        f"{name}={stats[name]:.2f}" if stats[name] is not None else f"{name}=n/a"
+                        for name in ("mean", "min", "max")
+                    )
+                    part += f"  {col}: {values}\n"
             
             summary_parts.append(part)
         
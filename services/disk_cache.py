@@ -0,0 +1,102 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Any
+
+# Size-bounded LRU directory of downloaded objects. Files are fetched to a temp
+# name and renamed into place, so readers (and other processes) never see a
+# partial file; concurrent requests for one key in this process share a download.
+class ReadThroughDiskCache:
+    def __init__(self, directory: str, max_bytes: int, min_age_seconds: int = 300):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.min_age = min_age_seconds  # Recently used files may still be open by a report job
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self.stats = {
+            "hits": 0, "misses": 0, "shared_downloads": 0,
+            "evictions": 0, "evicted_bytes": 0, "download_errors": 0
+        }
+        self._size = sum(p.stat().st_size for p in self.directory.iterdir() if p.is_file() and not p.name.endswith(".tmp"))
+
+    def _path_for(self, key: str) -> Path:
+        # Keep the basename (and extension) readable; prefix with a digest for uniqueness
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        return self.directory / f"{digest}_{Path(key).name}"
+
+    def get(self, key: str, fetch: Callable[[str], None]) -> str:
+        path = self._path_for(key)
+        if path.exists():
+            os.utime(path)  # mtime doubles as the LRU timestamp
+            with self._lock:
+                self.stats["hits"] += 1
+            return str(path)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        waited = not key_lock.acquire(blocking=False)
+        if waited:
+            key_lock.acquire()
+        try:
+            if path.exists():
+                # Another thread finished the download while we waited
+                os.utime(path)
+                with self._lock:
+                    self.stats["shared_downloads" if waited else "hits"] += 1
+                return str(path)
+
+            tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+            try:
+                fetch(str(tmp_path))
+                os.replace(tmp_path, path)
+            except BaseException:
+                with self._lock:
+                    self.stats["download_errors"] += 1
+                if tmp_path.exists():
+                    tmp_path.unlink()
+                raise
+
+            with self._lock:
+                self.stats["misses"] += 1
+                self._size += path.stat().st_size
+            self._evict()
+            return str(path)
+        finally:
+            key_lock.release()
+            with self._lock:
+                self._key_locks.pop(key, None)
+
+    def _evict(self):
+        with self._lock:
+            if self._size <= self.max_bytes:
+                return
+            entries = []
+            for p in self.directory.iterdir():
+                if p.is_file() and not p.name.endswith(".tmp"):
+                    st = p.stat()
+                    entries.append((st.st_mtime, st.st_size, p))
+            entries.sort()
+
+            cutoff = time.time() - self.min_age
+            self._size = sum(size for _, size, _ in entries)
+            for mtime, size, p in entries:
+                if self._size <= self.max_bytes or mtime > cutoff:
+                    break
+                try:
+                    p.unlink()
+                except FileNotFoundError:
+                    pass
+                self._size -= size
+                self.stats["evictions"] += 1
+                self.stats["evicted_bytes"] += size
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size_bytes"] = self._size
+        stats["max_bytes"] = self.max_bytes
+        return stats
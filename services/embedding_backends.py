@@ -0,0 +1,114 @@
+from pathlib import Path
+from typing import List, Union
+import numpy as np
+from config import settings
+
+# Both encoders mirror SentenceTransformer.encode: a str gives a 1-D vector,
+# a list gives one row per text, and rows are L2-normalized.
+
+class TorchEncoder:
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32) -> np.ndarray:
+        return self.model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+
+class OnnxEncoder:
+    # int8 dynamically-quantized ONNX Runtime export of the same model for CPU-only pods
+    def __init__(self, model_name: str, model_dir: str, quantize: bool = True, threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_dir = Path(model_dir) / model_name.replace("/", "__")
+        self.model_name = model_name
+        model_path = self.model_dir / ("model.int8.onnx" if quantize else "model.onnx")
+        if not model_path.exists():
+            self._export(quantize)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.model_dir))
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _export(self, quantize: bool):
+        # One-off export; needs torch, which the serving pods then no longer load
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        print(f"Exporting {self.model_name} to ONNX in {self.model_dir}...")
+        self.model_dir.mkdir(parents=True, exist_ok=True)
+        hf_name = self.model_name if "/" in self.model_name else f"sentence-transformers/{self.model_name}"
+        tokenizer = AutoTokenizer.from_pretrained(hf_name)
+        model = AutoModel.from_pretrained(hf_name).eval()
+        tokenizer.save_pretrained(str(self.model_dir))
+
+        dummy = tokenizer(["export"], return_tensors="pt")
+        fp32_path = self.model_dir / "model.onnx"
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"]),
+                str(fp32_path),
+                input_names=["input_ids", "attention_mask", "token_type_ids"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "seq"},
+                    "attention_mask": {0: "batch", 1: "seq"},
+                    "token_type_ids": {0: "batch", 1: "seq"},
+                    "last_hidden_state": {0: "batch", 1: "seq"}
+                },
+                opset_version=14
+            )
+
+        if quantize:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(str(fp32_path), str(self.model_dir / "model.int8.onnx"), weight_type=QuantType.QInt8)
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32) -> np.ndarray:
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+
+        outputs = []
+        for start in range(0, len(batch), batch_size):
+            tokens = self.tokenizer(
+                batch[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=256,
+                return_tensors="np"
+            )
+            feed = {k: v.astype(np.int64) for k, v in tokens.items() if k in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+
+            # Mean pooling over real tokens, then L2 normalize (same as the sentence-transformers head)
+            mask = tokens["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            outputs.append(pooled.astype(np.float32))
+
+        embeddings = np.vstack(outputs) if outputs else np.zeros((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+def encoder_id(backend: str = None) -> str:
+    # Identifies which encoder produced a vector; the backends' outputs differ slightly
+    backend = (backend or settings.EMBEDDING_BACKEND).lower()
+    if backend == "onnx":
+        return "onnx-int8" if settings.ONNX_QUANTIZE else "onnx"
+    return backend
+
+def build_encoder(backend: str = None):
+    backend = (backend or settings.EMBEDDING_BACKEND).lower()
+    if backend == "onnx":
+        return OnnxEncoder(
+            settings.EMBEDDING_MODEL,
+            settings.ONNX_MODEL_DIR,
+            quantize=settings.ONNX_QUANTIZE,
+            threads=settings.ONNX_THREADS
+        )
+    if backend == "torch":
+        return TorchEncoder(settings.EMBEDDING_MODEL)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
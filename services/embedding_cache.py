@@ -0,0 +1,142 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Callable
+
+# Two-level cache for query embeddings: a per-process LRU in front of a small
+# SQLite file that every worker on the host shares.
+class EmbeddingCache:
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int,
+        ttl_seconds: int,
+        db_path: Optional[str] = None,
+        max_disk_entries: int = 100000,
+        prune_interval: float = 300.0
+    ):
+        self.namespace = namespace  # Model, version and backend, so a new encoder never reads stale vectors
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.db_path = db_path
+        self.max_disk_entries = max_disk_entries
+        self.prune_interval = prune_interval
+        self._next_prune_at = 0.0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+        if self.db_path:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                    "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS query_embeddings_created_at ON query_embeddings (created_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _key(self, text: str) -> str:
+        normalized = " ".join(text.lower().split())
+        return hashlib.sha256(f"{self.namespace}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: List[float], created_at: float):
+        self._entries[key] = (vector, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get(self, text: str) -> Optional[List[float]]:
+        key = self._key(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[1] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[0]
+                del self._entries[key]
+                self.stats["expired"] += 1
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        "SELECT vector, created_at FROM query_embeddings WHERE key = ? AND created_at > ?",
+                        (key, now - self.ttl)
+                    ).fetchone()
+                if row is not None:
+                    vector = array("f", row[0]).tolist()
+                    with self._lock:
+                        self._remember(key, vector, row[1])
+                        self.stats["disk_hits"] += 1
+                    return vector
+            except sqlite3.Error as e:
+                print(f"Warning: query cache read failed: {e}")
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, text: str, vector: List[float]):
+        key = self._key(text)
+        now = time.time()
+        with self._lock:
+            self._remember(key, vector, now)
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO query_embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                        (key, array("f", vector).tobytes(), now)
+                    )
+                    if now >= self._next_prune_at:
+                        self._next_prune_at = now + self.prune_interval
+                        self._prune(conn, now)
+            except sqlite3.Error as e:
+                print(f"Warning: query cache write failed: {e}")
+
+    def _prune(self, conn: sqlite3.Connection, now: float):
+        # Drop expired rows, then the oldest ones beyond max_disk_entries
+        conn.execute("DELETE FROM query_embeddings WHERE created_at <= ?", (now - self.ttl,))
+        excess = conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM query_embeddings WHERE key IN "
+                "(SELECT key FROM query_embeddings ORDER BY created_at LIMIT ?)",
+                (excess,)
+            )
+
+    def get_or_compute(self, text: str, compute: Callable[[str], List[float]]) -> List[float]:
+        vector = self.get(text)
+        if vector is None:
+            vector = compute(text)
+            self.put(text, vector)
+        return vector
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["max_entries"] = self.max_entries
+        stats["ttl_seconds"] = self.ttl
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,120 @@
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+from sqlalchemy.orm import Session
+from config import settings
+from database import Job, Report
+from .report_events import report_events
+
+class JobQueue:
+    # Durable queue on the jobs table. Claims use SELECT ... FOR UPDATE SKIP LOCKED on
+    # Postgres; the conditional UPDATE keeps claims exclusive on SQLite, which ignores it.
+
+    @staticmethod
+    def enqueue(
+        db: Session,
+        job_type: str,
+        payload: Dict[str, Any],
+        priority: int = 0,
+        max_attempts: Optional[int] = None
+    ) -> Job:
+        job = Job(
+            job_id=str(uuid.uuid4()),
+            job_type=job_type,
+            payload=payload,
+            status="queued",
+            priority=priority,
+            max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+            run_after=datetime.utcnow()
+        )
+        db.add(job)
+        return job
+
+    @staticmethod
+    def claim(db: Session, job_types: List[str], worker_id: str) -> Optional[Job]:
+        now = datetime.utcnow()
+        job = (
+            db.query(Job)
+            .filter(Job.status == "queued", Job.job_type.in_(job_types), Job.run_after <= now)
+            .order_by(Job.priority.desc(), Job.id)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if job is None:
+            db.rollback()
+            return None
+
+        claimed = db.query(Job).filter(Job.id == job.id, Job.status == "queued").update(
+            {
+                Job.status: "running",
+                Job.locked_by: worker_id,
+                Job.heartbeat_at: now,
+                Job.attempts: Job.attempts + 1
+            },
+            synchronize_session=False
+        )
+        db.commit()
+        if not claimed:
+            return None
+        db.refresh(job)
+        return job
+
+    @staticmethod
+    def heartbeat(db: Session, job_id: str, worker_id: str) -> bool:
+        # False means the job was reclaimed from this worker
+        updated = db.query(Job).filter(
+            Job.job_id == job_id, Job.locked_by == worker_id, Job.status == "running"
+        ).update({Job.heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+        return updated == 1
+
+    @staticmethod
+    def complete(db: Session, job_id: str, worker_id: str):
+        db.query(Job).filter(Job.job_id == job_id, Job.locked_by == worker_id).update(
+            {Job.status: "completed", Job.locked_by: None},
+            synchronize_session=False
+        )
+        db.commit()
+
+    @staticmethod
+    def fail(db: Session, job_id: str, worker_id: str, error: str):
+        # Retry with linear backoff until max_attempts, then give up
+        job = db.query(Job).filter(Job.job_id == job_id, Job.locked_by == worker_id).first()
+        if job is None:
+            return
+        job.last_error = error
+        job.locked_by = None
+        if job.attempts < job.max_attempts:
+            job.status = "queued"
+            job.run_after = datetime.utcnow() + timedelta(seconds=30 * job.attempts)
+        else:
+            job.status = "failed"
+        db.commit()
+
+    @staticmethod
+    def reclaim_stale(db: Session, stale_after: Optional[int] = None) -> int:
+        # Requeue running jobs whose worker stopped heartbeating (crash, restart, OOM kill).
+        # Their reports move with them, so status subscribers and /retry see the outcome.
+        cutoff = datetime.utcnow() - timedelta(seconds=stale_after or settings.JOB_STALE_AFTER)
+        stale = (
+            db.query(Job)
+            .filter(Job.status == "running", Job.heartbeat_at < cutoff)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        changed = []
+        for job in stale:
+            job.locked_by = None
+            job.last_error = "Worker heartbeat lost"
+            job.status = "queued" if job.attempts < job.max_attempts else "failed"
+            report_status = "pending" if job.status == "queued" else "failed"
+            reports = db.query(Report).filter(Report.job_id == job.job_id, Report.status != "completed").all()
+            for report in reports:
+                report.status = report_status
+                if report_status == "failed":
+                    report.error_message = f"Worker stopped responding after {job.attempts} attempt(s)"
+                changed.append((report.report_id, report_status))
+        db.commit()
+        for report_id, status in changed:
+            report_events.publish(db, report_id, status)
+        return len(stale)
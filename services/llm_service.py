@@ -97,8 +97,8 @@ class GeminiLLMService:
         print(f"Gemini API Key: {settings.GEMINI_API_KEY}")
         self.model = "gemini-2.5-flash"  # or "gemini-2.5-flash"
         
-    def generate_insights(self, csv_summary: str, vision_insights: str, user_description: str) -> Dict[str, Any]:
-        prompt = f"""You are a business analytics AI. Analyze the following data and generate a comprehensive report.
+    def build_insights_prompt(self, csv_summary: str, vision_insights: str, user_description: str) -> str:
+        return f"""You are a business analytics AI. Analyze the following data and generate a comprehensive report.
 
 USER REQUEST: {user_description}
 
@@ -138,33 +138,43 @@ Generate a JSON response with the following structure:
 Provide actionable, specific insights based on the data. Be concise but comprehensive.
 IMPORTANT: Respond with ONLY valid JSON. Do not include any markdown formatting, backticks, or explanatory text."""
 
+    def complete_json(self, prompt: str) -> str:
+        # Raw model output; raises on API errors
+        response = self.client.models.generate_content(
+            model=self.model,
+            contents=prompt,
+            config={
+                "temperature": 0.7,
+                "response_mime_type": "application/json"
+            }
+        )
+        return response.text
+
+    @staticmethod
+    def parse_insights(response_text: str) -> Dict[str, Any]:
+        # Clean the response text and parse JSON; raises json.JSONDecodeError
+        response_text = response_text.strip()
+        
+        # Remove markdown code blocks if present
+        if response_text.startswith("```json"):
+            response_text = response_text[7:]
+        if response_text.startswith("```"):
+            response_text = response_text[3:]
+        if response_text.endswith("```"):
+            response_text = response_text[:-3]
+        
+        return json.loads(response_text.strip())
+
+    def generate_insights(self, csv_summary: str, vision_insights: str, user_description: str) -> Dict[str, Any]:
+        prompt = self.build_insights_prompt(csv_summary, vision_insights, user_description)
+        response_text = ""
         try:
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=prompt,
-                config={
-                    "temperature": 0.7,
-                    "response_mime_type": "application/json"
-                }
-            )
-            
-            # Clean the response text and parse JSON
-            response_text = response.text.strip()
-            
-            # Remove markdown code blocks if present
-            if response_text.startswith("```json"):
-                response_text = response_text[7:]
-            if response_text.startswith("```"):
-                response_text = response_text[3:]
-            if response_text.endswith("```"):
-                response_text = response_text[:-3]
-            
-            result = json.loads(response_text.strip())
-            return result
+            response_text = self.complete_json(prompt)
+            return self.parse_insights(response_text)
             
         except json.JSONDecodeError as e:
             print(f"JSON parsing error: {e}")
-            print(f"Response was: {response.text[:500]}")
+            print(f"Response was: {response_text[:500]}")
             return {
                 "summary": "Error parsing response. Please try again.",
                 "key_metrics": [],
@@ -0,0 +1,266 @@
+import json
+import os
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Callable
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single process
+    fcntl = None
+
+# Mirrors the attributes of a Qdrant ScoredPoint that callers read
+LocalHit = namedtuple("LocalHit", ["id", "score", "payload"])
+
+# Embedded float16 index used when no Qdrant server is reachable. Writes made while
+# Qdrant is down go to a write-ahead log that QdrantService replays on reconnect.
+#
+# Several processes (API, workers) may share the directory. Metadata is an append-only
+# log (meta.jsonl) of row assignments, so a write costs one vector row plus one line
+# regardless of index size. Writers hold an exclusive file lock and first catch up on
+# lines other processes appended, so row numbers are never handed out twice. The log is
+# compacted once it is mostly superseded entries; other processes notice the new file
+# and reload it.
+class LocalVectorIndex:
+    def __init__(self, path: str, dim: int, initial_capacity: int = 1024):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.row_bytes = 2 * dim
+        self.vectors_file = self.path / "vectors.f16"
+        self.meta_file = self.path / "meta.jsonl"
+        self.wal_file = self.path / "wal.jsonl"
+        self.lock_file = self.path / "index.lock"
+        self.replay_lock_file = self.path / "replay.lock"
+        self._lock = threading.RLock()
+
+        self._reset()
+        with self._file_lock(exclusive=True):
+            if not self.vectors_file.exists():
+                with open(self.vectors_file, "wb") as f:
+                    f.truncate(initial_capacity * self.row_bytes)
+            self._catch_up()
+
+    def _reset(self):
+        self.ids: List[Optional[str]] = []
+        self.payloads: List[Optional[Dict[str, Any]]] = []
+        self._row_of: Dict[str, int] = {}
+        self._meta_offset = 0
+        self._meta_inode = None
+        self._meta_lines = 0
+        self.matrix = None
+        self.capacity = 0
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        with open(self.lock_file, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _apply(self, entry: Dict[str, Any]):
+        row = entry["row"]
+        while len(self.ids) <= row:
+            self.ids.append(None)
+            self.payloads.append(None)
+        previous = self.ids[row]
+        if previous is not None and self._row_of.get(previous) == row:
+            del self._row_of[previous]
+        self.ids[row] = entry["id"]
+        self.payloads[row] = entry.get("payload") if entry["id"] is not None else None
+        if entry["id"] is not None:
+            self._row_of[entry["id"]] = row
+
+    def _catch_up(self):
+        # Apply metadata lines appended since we last looked; caller holds the file lock
+        try:
+            stat = os.stat(self.meta_file)
+        except FileNotFoundError:
+            stat = None
+        if stat is not None and stat.st_ino != self._meta_inode:
+            # First load, or another process compacted the log
+            self._reset()
+            self._meta_inode = stat.st_ino
+        if stat is not None and stat.st_size > self._meta_offset:
+            with open(self.meta_file, "rb") as f:
+                f.seek(self._meta_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Torn write from a crashed process; fixed up by the next writer
+                    self._meta_offset += len(line)
+                    self._meta_lines += 1
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        continue
+
+        # Another process may have grown the vector file
+        file_rows = os.path.getsize(self.vectors_file) // self.row_bytes
+        if self.matrix is None or file_rows > self.capacity:
+            self._open_matrix(file_rows)
+
+    def _open_matrix(self, capacity: int):
+        self.matrix = np.memmap(self.vectors_file, dtype=np.float16, mode="r", shape=(capacity, self.dim))
+        self.capacity = capacity
+
+    def _append_meta(self, entries: List[Dict[str, Any]]):
+        # Caller holds the exclusive lock and has caught up
+        data = "".join(json.dumps(entry) + "\n" for entry in entries).encode("utf-8")
+        with open(self.meta_file, "ab") as f:
+            if f.tell() > self._meta_offset:
+                # Torn trailing line: terminate it so it is skipped, not merged with ours
+                data = b"\n" + data
+            f.write(data)
+            f.flush()
+            self._meta_offset = f.tell()
+        if self._meta_inode is None:
+            self._meta_inode = os.stat(self.meta_file).st_ino
+        self._meta_lines += len(entries)
+        for entry in entries:
+            self._apply(entry)
+
+    def _write_vector(self, row: int, vec: np.ndarray):
+        if row >= self.capacity:
+            # Grow the backing file; existing rows keep their offsets
+            with open(self.vectors_file, "r+b") as f:
+                f.truncate(max(self.capacity * 2, row + 1) * self.row_bytes)
+            self._open_matrix(os.path.getsize(self.vectors_file) // self.row_bytes)
+        # One positioned write of one row; readers' shared mappings see it via the page cache
+        with open(self.vectors_file, "r+b") as f:
+            f.seek(row * self.row_bytes)
+            f.write(vec.astype(np.float16).tobytes())
+
+    def _maybe_compact(self):
+        # Rewrite the log as one line per live row once it is mostly superseded entries
+        live = len(self._row_of)
+        if self._meta_lines <= 2 * live + 1024:
+            return
+        tmp = self.meta_file.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            for row, pid in enumerate(self.ids):
+                if pid is not None:
+                    f.write(json.dumps({"row": row, "id": pid, "payload": self.payloads[row]}) + "\n")
+        os.replace(tmp, self.meta_file)
+        stat = os.stat(self.meta_file)
+        self._meta_inode = stat.st_ino
+        self._meta_offset = stat.st_size
+        self._meta_lines = live
+
+    def _log(self, entry: Dict[str, Any]):
+        with open(self.wal_file, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def upsert(self, point_id: str, vector: List[float], payload: Dict[str, Any], log: bool = False):
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm  # Store normalized so search is a dot product
+
+        with self._lock, self._file_lock(exclusive=True):
+            if log:
+                self._log({"op": "upsert", "id": point_id, "vector": list(vector), "payload": payload})
+            self._catch_up()
+            row = self._row_of.get(point_id)
+            if row is None:
+                row = len(self.ids)
+            self._write_vector(row, vec)
+            self._append_meta([{"row": row, "id": point_id, "payload": payload}])
+            self._maybe_compact()
+
+    def delete(self, point_ids: List[str], log: bool = False):
+        with self._lock, self._file_lock(exclusive=True):
+            if log:
+                self._log({"op": "delete", "ids": list(point_ids)})
+            self._catch_up()
+            entries = [{"row": self._row_of[pid], "id": None} for pid in point_ids if pid in self._row_of]
+            if entries:
+                self._append_meta(entries)
+                self._maybe_compact()
+
+    def search(
+        self,
+        vector: List[float],
+        limit: int,
+        payload_filter: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        chunk_rows: int = 65536
+    ) -> List[LocalHit]:
+        with self._lock:
+            with self._file_lock(exclusive=False):
+                self._catch_up()
+            n = len(self.ids)
+            if n == 0 or limit <= 0:
+                return []
+
+            query = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            if norm > 0:
+                query = query / norm
+
+            # Score in chunks so float32 upcasting never materializes the whole matrix
+            scores = np.empty(n, dtype=np.float32)
+            for start in range(0, n, chunk_rows):
+                stop = min(start + chunk_rows, n)
+                scores[start:stop] = self.matrix[start:stop].astype(np.float32) @ query
+            for row, pid in enumerate(self.ids):
+                if pid is None or (payload_filter is not None and not payload_filter(self.payloads[row])):
+                    scores[row] = -np.inf
+
+            k = min(limit, n)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                LocalHit(self.ids[row], float(scores[row]), self.payloads[row])
+                for row in top
+                if np.isfinite(scores[row])
+            ]
+
+    def has_pending_writes(self) -> bool:
+        return self.wal_file.exists() and self.wal_file.stat().st_size > 0
+
+    @contextmanager
+    def replay_lock(self):
+        # Yields True in at most one process at a time, so buffered writes aren't
+        # replayed (and truncated) twice
+        with open(self.replay_lock_file, "a") as f:
+            if fcntl is None:
+                yield True
+                return
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def pending_writes(self) -> List[Dict[str, Any]]:
+        with self._lock, self._file_lock(exclusive=False):
+            if not self.wal_file.exists():
+                return []
+            with open(self.wal_file) as f:
+                return [json.loads(line) for line in f if line.strip()]
+
+    def truncate_wal(self, applied: int):
+        # Drop the first `applied` entries, keeping anything logged during replay
+        with self._lock, self._file_lock(exclusive=True):
+            with open(self.wal_file) as f:
+                remaining = [line for line in f if line.strip()][applied:]
+            tmp = self.wal_file.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                f.writelines(remaining)
+            os.replace(tmp, self.wal_file)
@@ -0,0 +1,31 @@
+import hashlib
+import json
+from typing import Any, Dict, Optional
+from .pdf_render_pool import pdf_render_pool
+
+def result_hash(result: Dict[str, Any]) -> str:
+    # Stable across key order, so the same result always maps to the same PDF / ETag
+    canonical = json.dumps(result, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class PdfCache:
+    # Rendered PDFs stored in the storage backend under report_id + result hash. A
+    # completed result never changes, so a cached PDF is valid for as long as it exists.
+
+    def __init__(self, storage_service):
+        self.storage = storage_service
+
+    def _location(self, report_id: str, digest: str) -> str:
+        return f"rendered/pdf/{report_id}/{digest}.pdf"
+
+    def get_path(self, report_id: str, digest: str) -> Optional[str]:
+        # Local file path of the cached PDF, or None if it hasn't been rendered yet
+        return self.storage.get_object_path(self._location(report_id, digest))
+
+    def render(self, report_id: str, result: Dict[str, Any], digest: str) -> str:
+        pdf_bytes = pdf_render_pool.render(result, report_id)
+        self.storage.put_bytes(self._location(report_id, digest), pdf_bytes, content_type="application/pdf")
+        return self.get_path(report_id, digest)
+
+    def get_or_render(self, report_id: str, result: Dict[str, Any], digest: str) -> str:
+        return self.get_path(report_id, digest) or self.render(report_id, result, digest)
@@ -0,0 +1,84 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+from fastapi import HTTPException
+from config import settings
+from .pdf_service import render_pdf_bytes
+
+class RenderPoolBusyError(HTTPException):
+    def __init__(self, retry_after: int):
+        super().__init__(
+            status_code=503,
+            detail="PDF renderer is busy, please retry shortly",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+def _noop():
+    return None
+
+def _mp_context(fork: bool):
+    methods = multiprocessing.get_all_start_methods()
+    if fork and "fork" in methods:
+        return multiprocessing.get_context("fork")
+    if "forkserver" in methods:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["services.pdf_service"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+class PdfRenderPool:
+    # ReportLab is pure-Python and CPU-bound, so PDFs render in worker processes
+    # instead of on the event loop or under the GIL. At most workers + queue_size
+    # renders are admitted at once; further callers wait up to PDF_RENDER_WAIT_SECONDS
+    # for a slot and then get a 503, so a burst can't pile up unbounded work.
+
+    def __init__(self, workers: Optional[int] = None, queue_size: Optional[int] = None):
+        self.workers = workers or settings.PDF_RENDER_WORKERS
+        queue_size = settings.PDF_RENDER_QUEUE_SIZE if queue_size is None else queue_size
+        self._slots = threading.BoundedSemaphore(self.workers + queue_size)
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self, fork: bool = False) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=_mp_context(fork)
+                )
+            return self._executor
+
+    def start(self):
+        # fork: children start instantly and never re-import the app module. Only safe
+        # before the app starts background threads, which is when this must be called.
+        # Pools created later (lazily, or after a crash) use forkserver/spawn instead,
+        # since forking a multi-threaded process can deadlock children on inherited locks.
+        self._get_executor(fork=True).submit(_noop).result()
+
+    def render(self, report_data: Dict[str, Any], report_id: str) -> bytes:
+        if not self._slots.acquire(timeout=settings.PDF_RENDER_WAIT_SECONDS):
+            raise RenderPoolBusyError(retry_after=max(1, int(settings.PDF_RENDER_WAIT_SECONDS)))
+        try:
+            executor = self._get_executor()
+            try:
+                return executor.submit(render_pdf_bytes, report_data, report_id).result()
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM kill); replace the pool and retry once
+                print("Warning: PDF render pool broke, restarting it")
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                executor.shutdown(wait=False)
+                return self._get_executor().submit(render_pdf_bytes, report_data, report_id).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+pdf_render_pool = PdfRenderPool()
@@ -1,107 +1,490 @@
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, PointIdsList, HnswConfigDiff,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    BinaryQuantization, BinaryQuantizationConfig,
+    SearchParams, QuantizationSearchParams, VectorParamsDiff,
+    CollectionParamsDiff, Disabled, PayloadSchemaType,
+    Filter, FieldCondition, Range, MatchAny
+)
+from typing import List, Dict, Any, Callable, Optional
+from datetime import datetime, timezone
 from config import settings
+from .local_vector_index import LocalVectorIndex
+from .embedding_cache import EmbeddingCache
+from .embedding_backends import build_encoder, encoder_id
+import threading
+import time
 import uuid
 from google import genai
 
+# Fixed namespace so the same report always maps to the same point ID
+POINT_ID_NAMESPACE = uuid.UUID("5b0c6f1e-8a3d-4d6e-9a0b-2f1c7e4d9a10")
+
+def build_quantization_config(mode: str = None):
+    mode = (mode or settings.QDRANT_QUANTIZATION).lower()
+    if mode == "scalar":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8,
+                quantile=0.99,
+                always_ram=settings.QDRANT_QUANTIZATION_ALWAYS_RAM
+            )
+        )
+    if mode == "binary":
+        return BinaryQuantization(
+            binary=BinaryQuantizationConfig(always_ram=settings.QDRANT_QUANTIZATION_ALWAYS_RAM)
+        )
+    if mode == "none":
+        return None
+    raise ValueError(f"Unknown QDRANT_QUANTIZATION mode: {mode}")
+
+def build_collection_config(vector_size: int, quantization: str = None) -> Dict[str, Any]:
+    # Keyword arguments for create_collection, driven by the QDRANT_* layout settings
+    return {
+        "vectors_config": VectorParams(
+            size=vector_size,
+            distance=Distance.COSINE,
+            on_disk=settings.QDRANT_ON_DISK_VECTORS
+        ),
+        "hnsw_config": HnswConfigDiff(
+            m=settings.QDRANT_HNSW_M,
+            ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT
+        ),
+        "quantization_config": build_quantization_config(quantization),
+        "on_disk_payload": settings.QDRANT_ON_DISK_PAYLOAD
+    }
+
+# Payload fields that search filters on, indexed so filtering doesn't scan payloads
+PAYLOAD_INDEXES = {
+    "report_id": PayloadSchemaType.KEYWORD,
+    "created_at": PayloadSchemaType.INTEGER,
+    "metric_names": PayloadSchemaType.KEYWORD,
+    "tags": PayloadSchemaType.KEYWORD
+}
+
+def to_epoch(value: datetime) -> int:
+    # Naive datetimes are UTC throughout the app (datetime.utcnow)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+def build_search_filter(filters: Optional[Dict[str, Any]]) -> Optional[Filter]:
+    if not filters:
+        return None
+    must = []
+    created_range = {}
+    if filters.get("created_after") is not None:
+        created_range["gte"] = to_epoch(filters["created_after"])
+    if filters.get("created_before") is not None:
+        created_range["lte"] = to_epoch(filters["created_before"])
+    if created_range:
+        must.append(FieldCondition(key="created_at", range=Range(**created_range)))
+    if filters.get("metric_names"):
+        names = [n.lower() for n in filters["metric_names"]]
+        must.append(FieldCondition(key="metric_names", match=MatchAny(any=names)))
+    if filters.get("tags"):
+        must.append(FieldCondition(key="tags", match=MatchAny(any=list(filters["tags"]))))
+    return Filter(must=must) if must else None
+
+def payload_matches(payload: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+    # Same semantics as build_search_filter, for the embedded index
+    if not filters:
+        return True
+    created_at = payload.get("created_at")
+    if filters.get("created_after") is not None:
+        if created_at is None or created_at < to_epoch(filters["created_after"]):
+            return False
+    if filters.get("created_before") is not None:
+        if created_at is None or created_at > to_epoch(filters["created_before"]):
+            return False
+    if filters.get("metric_names"):
+        wanted = {n.lower() for n in filters["metric_names"]}
+        if not wanted & set(payload.get("metric_names", [])):
+            return False
+    if filters.get("tags") and not set(filters["tags"]) & set(payload.get("tags", [])):
+        return False
+    return True
+
+def build_search_params(quantization: str = None) -> SearchParams:
+    mode = (quantization or settings.QDRANT_QUANTIZATION).lower()
+    quantization_params = None
+    if mode != "none":
+        # Search the compressed vectors, then rescore the oversampled candidates with originals
+        quantization_params = QuantizationSearchParams(
+            rescore=settings.QDRANT_SEARCH_RESCORE,
+            oversampling=settings.QDRANT_SEARCH_OVERSAMPLING
+        )
+    return SearchParams(hnsw_ef=settings.QDRANT_HNSW_EF_SEARCH, quantization=quantization_params)
+
 class QdrantService:
     def __init__(self):
-        self.client = QdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT)
+        self.backend = settings.VECTOR_BACKEND.lower()
+        self.client = None
+        if self.backend != "local":
+            self.client = QdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT)
         self.collection_name = settings.QDRANT_COLLECTION
-        self.encoder = SentenceTransformer('all-MiniLM-L6-v2')
+        self.encoder = build_encoder()
         self.vector_size = 384  # all-MiniLM-L6-v2 embedding size
-        
+        self.embedding_version = f"{settings.EMBEDDING_MODEL}:{settings.EMBEDDING_MODEL_VERSION}"
+        self.search_params = build_search_params()
+        self.query_cache = EmbeddingCache(
+            namespace=f"{self.embedding_version}:{encoder_id()}",
+            max_entries=settings.QUERY_CACHE_SIZE,
+            ttl_seconds=settings.QUERY_CACHE_TTL,
+            db_path=settings.QUERY_CACHE_PATH,
+            max_disk_entries=settings.QUERY_CACHE_DISK_MAX_ENTRIES
+        )
+
+        # Embedded index: the only store in "local" mode, a replica and write buffer in "auto"
+        self.local_index = None
+        if self.backend in ("local", "auto"):
+            self.local_index = LocalVectorIndex(settings.LOCAL_INDEX_PATH, self.vector_size)
+        self._next_replay_at = 0.0
+        self._replay_lock = threading.Lock()
+
         # Create collection if not exists
         self._init_collection()
-    
+
     def _init_collection(self):
+        if self.client is None:
+            return
         try:
             collections = self.client.get_collections().collections
             exists = any(c.name == self.collection_name for c in collections)
-            
+
             if not exists:
                 self.client.create_collection(
                     collection_name=self.collection_name,
-                    vectors_config=VectorParams(size=self.vector_size, distance=Distance.COSINE)
+                    **build_collection_config(self.vector_size)
                 )
                 print(f"Created Qdrant collection: {self.collection_name}")
             else:
                 print(f"Qdrant collection already exists: {self.collection_name}")
+
+            # Creating an existing payload index is a no-op, so this also upgrades old collections
+            for field_name, schema in PAYLOAD_INDEXES.items():
+                self.client.create_payload_index(
+                    collection_name=self.collection_name,
+                    field_name=field_name,
+                    field_schema=schema
+                )
         except Exception as e:
             print(f"Warning: Could not initialize Qdrant collection: {e}")
-    
+
+    def _replay_pending_writes(self):
+        # Push writes buffered while Qdrant was down; throttled so an outage doesn't add
+        # a failing round trip to every request
+        if self.client is None or self.local_index is None or not self.local_index.has_pending_writes():
+            return
+        now = time.monotonic()
+        if now < self._next_replay_at or not self._replay_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_replay_at = now + settings.LOCAL_INDEX_REPLAY_INTERVAL
+            # Processes sharing the index take turns; the others skip this round
+            with self.local_index.replay_lock() as acquired:
+                if acquired:
+                    self._replay_entries()
+        finally:
+            self._replay_lock.release()
+
+    def _replay_entries(self):
+        entries = self.local_index.pending_writes()
+        applied = 0
+        try:
+            self._init_collection()
+            for entry in entries:
+                if entry["op"] == "upsert":
+                    self.client.upsert(
+                        collection_name=self.collection_name,
+                        points=[PointStruct(id=entry["id"], vector=entry["vector"], payload=entry["payload"])]
+                    )
+                elif entry["op"] == "delete":
+                    self.client.delete(
+                        collection_name=self.collection_name,
+                        points_selector=PointIdsList(points=entry["ids"])
+                    )
+                applied += 1
+        except Exception as e:
+            print(f"Qdrant still unavailable, {len(entries) - applied} buffered write(s) pending: {e}")
+        if applied:
+            self.local_index.truncate_wal(applied)
+            print(f"Replayed {applied} buffered write(s) into Qdrant")
+            if applied == len(entries):
+                self._next_replay_at = 0.0
+
+    def migrate_collection(self) -> bool:
+        if self.client is None:
+            return False
+        # Apply the configured layout to an existing collection in place; Qdrant rebuilds
+        # the HNSW graph and quantized vectors in the background while serving queries
+        try:
+            config = build_collection_config(self.vector_size)
+            quantization = config["quantization_config"]
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                vectors_config={"": VectorParamsDiff(on_disk=settings.QDRANT_ON_DISK_VECTORS)},
+                hnsw_config=config["hnsw_config"],
+                quantization_config=quantization if quantization is not None else Disabled.DISABLED
+            )
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                collection_params=CollectionParamsDiff(on_disk_payload=settings.QDRANT_ON_DISK_PAYLOAD)
+            )
+            print(f"Migrated Qdrant collection layout: {self.collection_name}")
+            return True
+        except Exception as e:
+            print(f"Error migrating collection: {e}")
+            return False
+
+    def point_id(self, report_id: str) -> str:
+        # Deterministic ID: reprocessing a report overwrites its point instead of adding one
+        return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{report_id}:{self.embedding_version}"))
+
     def embed_text(self, text: str) -> List[float]:
         embedding = self.encoder.encode(text)
         return embedding.tolist()
-    
-    def store_report_embedding(self, report_id: str, report_data: Dict[str, Any]):
+
+    def embed_query(self, query: str) -> List[float]:
+        return self.query_cache.get_or_compute(query, self.embed_text)
+
+    def warmup_queries(self, queries: List[str]) -> int:
+        # Batch-encode uncached queries in one forward pass
+        missing = [q for q in queries if self.query_cache.get(q) is None]
+        if missing:
+            for query, embedding in zip(missing, self.encoder.encode(missing)):
+                self.query_cache.put(query, embedding.tolist())
+        print(f"Warmed query cache: {len(missing)} new, {len(queries) - len(missing)} cached")
+        return len(missing)
+
+    def store_report_embedding(self, report_id: str, report_data: Dict[str, Any], tags: Optional[List[str]] = None):
         try:
             # Create text representation of report
             text_parts = []
-            
+
             if isinstance(report_data.get('summary'), str):
                 text_parts.append(f"Summary: {report_data['summary']}")
-            
+
             if 'key_metrics' in report_data:
                 metrics_text = ", ".join([
-                    f"{m.get('name', '')}: {m.get('value', '')}" 
+                    f"{m.get('name', '')}: {m.get('value', '')}"
                     for m in report_data['key_metrics']
                 ])
                 text_parts.append(f"Metrics: {metrics_text}")
-            
+
             if 'trends' in report_data:
                 trends_text = ", ".join([
-                    t.get('description', '') 
+                    t.get('description', '')
                     for t in report_data['trends']
                 ])
                 text_parts.append(f"Trends: {trends_text}")
-            
+
             full_text = " | ".join(text_parts)
-            
+
+            try:
+                created_at = to_epoch(datetime.fromisoformat(report_data["generated_at"]))
+            except (KeyError, TypeError, ValueError):
+                created_at = int(time.time())
+
             # Generate embedding
             embedding = self.embed_text(full_text)
-            
-            # Store in Qdrant
+
+            # Store in Qdrant (upsert on the deterministic ID replaces any earlier version)
             point = PointStruct(
-                id=str(uuid.uuid4()),
+                id=self.point_id(report_id),
                 vector=embedding,
                 payload={
                     "report_id": report_id,
                     "summary": report_data.get('summary', ''),
-                    "text": full_text[:1000]  # Store truncated text
+                    "text": full_text[:1000],  # Store truncated text
+                    "embedding_version": self.embedding_version,
+                    "created_at": created_at,
+                    "metric_names": sorted({
+                        str(m.get('name', '')).lower()
+                        for m in report_data.get('key_metrics', [])
+                        if m.get('name')
+                    }),
+                    "tags": list(tags or [])
                 }
             )
-            
-            self.client.upsert(
-                collection_name=self.collection_name,
-                points=[point]
-            )
-            
-            return True
         except Exception as e:
             print(f"Error storing embedding: {e}")
             return False
-    
-    def search_similar_reports(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+
+        return self._write_point(point)
+
+    def _write_point(self, point: PointStruct) -> bool:
+        if self.client is not None:
+            self._replay_pending_writes()
+            try:
+                self.client.upsert(
+                    collection_name=self.collection_name,
+                    points=[point]
+                )
+                if self.local_index is not None:
+                    self.local_index.upsert(point.id, point.vector, point.payload)
+                return True
+            except Exception as e:
+                if self.local_index is None:
+                    print(f"Error storing embedding: {e}")
+                    return False
+                print(f"Qdrant unavailable, buffering embedding locally: {e}")
+
+        # Local-only mode, or Qdrant down: log the write so it replays on reconnect
+        self.local_index.upsert(point.id, point.vector, point.payload, log=self.client is not None)
+        return True
+
+    def search_similar_reports(
+        self,
+        query: str,
+        limit: int = 5,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
         try:
-            query_embedding = self.embed_text(query)
-            
-            results = self.client.search(
-                collection_name=self.collection_name,
-                query_vector=query_embedding,
-                limit=limit
-            )
-            
-            return [
-                {
-                    "report_id": hit.payload.get("report_id"),
-                    "summary": hit.payload.get("summary"),
-                    "score": hit.score
-                }
-                for hit in results
-            ]
+            query_embedding = self.embed_query(query)
         except Exception as e:
             print(f"Error searching: {e}")
             return []
+
+        # Over-fetch so collapsing duplicates of one report still fills the page
+        if self.client is not None:
+            self._replay_pending_writes()
+            try:
+                results = self.client.search(
+                    collection_name=self.collection_name,
+                    query_vector=query_embedding,
+                    limit=limit * 3,
+                    query_filter=build_search_filter(filters),
+                    search_params=self.search_params
+                )
+                return self._collapse_hits(results, limit)
+            except Exception as e:
+                print(f"Error searching: {e}")
+                if self.local_index is None:
+                    return []
+
+        results = self.local_index.search(
+            query_embedding,
+            limit * 3,
+            payload_filter=lambda payload: payload_matches(payload, filters)
+        )
+        return self._collapse_hits(results, limit)
+
+    def _collapse_hits(self, hits, limit: int) -> List[Dict[str, Any]]:
+        # Keep only the best-scoring hit per report_id (hits arrive sorted by score)
+        collapsed = []
+        seen = set()
+        for hit in hits:
+            report_id = hit.payload.get("report_id")
+            if report_id in seen:
+                continue
+            seen.add(report_id)
+            collapsed.append({
+                "report_id": report_id,
+                "summary": hit.payload.get("summary"),
+                "score": hit.score
+            })
+            if len(collapsed) >= limit:
+                break
+        return collapsed
+
+    def dedupe_collection(
+        self,
+        load_report: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None,
+        batch_size: int = 256
+    ) -> int:
+        if self.client is None:
+            return 0
+        # Sweep legacy points so each report has one point under its deterministic ID.
+        # Only the fields needed to decide are fetched, to keep the scan's memory small.
+        try:
+            groups: Dict[str, List[Any]] = {}
+            offset = None
+            while True:
+                points, offset = self.client.scroll(
+                    collection_name=self.collection_name,
+                    limit=batch_size,
+                    offset=offset,
+                    with_payload=["report_id", "embedding_version", "created_at", "generated_at"],
+                    with_vectors=False
+                )
+                for p in points:
+                    payload = p.payload or {}
+                    if payload.get("report_id"):
+                        groups.setdefault(payload["report_id"], []).append(
+                            (str(p.id), payload.get("embedding_version"), _point_time(payload))
+                        )
+                if offset is None:
+                    break
+
+            removed = 0
+            reembedded = 0
+            for report_id, points in groups.items():
+                target_id = self.point_id(report_id)
+                ids = [pid for pid, _, _ in points]
+                if target_id not in ids:
+                    current = [p for p in points if p[1] == self.embedding_version]
+                    if current:
+                        # Re-key the newest copy made by the current encoder
+                        newest = max(current, key=lambda p: p[2])[0]
+                        keep = self.client.retrieve(
+                            collection_name=self.collection_name,
+                            ids=[newest],
+                            with_payload=True,
+                            with_vectors=True
+                        )[0]
+                        self.client.upsert(
+                            collection_name=self.collection_name,
+                            points=[PointStruct(id=target_id, vector=keep.vector, payload=keep.payload)]
+                        )
+                    else:
+                        # Only vectors from an older encoder: re-embed from the stored report,
+                        # never relabel an old vector as the current version
+                        if load_report is None:
+                            continue
+                        report_data = load_report(report_id)
+                        if report_data is not None:
+                            newest = max(points, key=lambda p: p[2])[0]
+                            tags = (self.client.retrieve(
+                                collection_name=self.collection_name,
+                                ids=[newest],
+                                with_payload=["tags"]
+                            )[0].payload or {}).get("tags", [])
+                            if not self.store_report_embedding(report_id, report_data, tags):
+                                continue
+                            reembedded += 1
+                stale = [pid for pid in ids if pid != target_id]
+                if stale:
+                    self.client.delete(
+                        collection_name=self.collection_name,
+                        points_selector=PointIdsList(points=stale)
+                    )
+                    removed += len(stale)
+
+            print(f"Qdrant dedupe sweep removed {removed} duplicate point(s), re-embedded {reembedded} report(s)")
+            return removed
+        except Exception as e:
+            print(f"Error during dedupe sweep: {e}")
+            return 0
+
+def _point_time(payload: Dict[str, Any]) -> int:
+    # When the point's report was generated; scroll order says nothing about age
+    if isinstance(payload.get("created_at"), (int, float)):
+        return int(payload["created_at"])
+    try:
+        return to_epoch(datetime.fromisoformat(payload["generated_at"]))
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ["migrate"]:
+        QdrantService().migrate_collection()
+    elif sys.argv[1:] == ["dedupe"]:
+        # Through ReportService, which can load reports that need re-embedding
+        from services.report_service import ReportService
+        ReportService().dedupe_report_embeddings()
+    else:
+        print("Usage: python -m services.qdrant_service [migrate|dedupe]")
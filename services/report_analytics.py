@@ -0,0 +1,187 @@
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import Integer, String, cast, delete, exists, func, select
+from sqlalchemy.orm import Session
+from database import Report, ReportMetric, ReportTrend
+
+BUCKETS = ("day", "week", "month", "quarter", "year")
+
+_NUMBER = re.compile(r"-?\d*\.?\d+(?:[eE][-+]?\d+)?")
+_SQLITE_FORMATS = {"day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m", "year": "%Y"}
+
+def normalize_metric_name(name: Any) -> str:
+    return " ".join(str(name).lower().split())
+
+def parse_metric_value(value: Any) -> Optional[float]:
+    # Gemini reports values like 12.5, "12.5%", "$1,204", "-3.2 pts"; keep the first number
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = str(value).replace(",", "").replace("−", "-")
+    cleaned = re.sub(r"(?<=-)\s*[$€£¥]\s*", "", cleaned)
+    match = _NUMBER.search(cleaned)
+    return float(match.group()) if match else None
+
+class ReportAnalytics:
+    # Keeps report_metrics / report_trends in step with Report.result and builds the
+    # filtered and aggregated queries the analytics endpoints run against them
+
+    @staticmethod
+    def index_report(db: Session, report: Report):
+        # Replaces this report's rows; commit together with the report's result
+        db.execute(delete(ReportMetric).where(ReportMetric.report_id == report.report_id))
+        db.execute(delete(ReportTrend).where(ReportTrend.report_id == report.report_id))
+
+        result = report.result or {}
+        created_at = report.created_at or datetime.utcnow()
+        for metric in result.get("key_metrics", []):
+            if not isinstance(metric, dict) or not metric.get("name"):
+                continue
+            value = metric.get("value")
+            db.add(ReportMetric(
+                report_id=report.report_id,
+                name=str(metric["name"]),
+                name_key=normalize_metric_name(metric["name"]),
+                value_num=parse_metric_value(value),
+                value_text=None if value is None else str(value),
+                unit=metric.get("unit"),
+                created_at=created_at
+            ))
+        for trend in result.get("trends", []):
+            if not isinstance(trend, dict):
+                continue
+            db.add(ReportTrend(
+                report_id=report.report_id,
+                description=trend.get("description", ""),
+                direction=str(trend.get("direction", "")).lower(),
+                impact=str(trend.get("impact", "")).lower(),
+                created_at=created_at
+            ))
+
+    @staticmethod
+    def backfill(db: Session, batch_size: int = 200) -> int:
+        # Index completed reports that predate the side tables
+        indexed = 0
+        last_id = 0
+        while True:
+            reports = (
+                db.query(Report)
+                .filter(
+                    Report.id > last_id,
+                    Report.status == "completed",
+                    Report.result.isnot(None),
+                    ~exists().where(ReportMetric.report_id == Report.report_id),
+                    ~exists().where(ReportTrend.report_id == Report.report_id)
+                )
+                .order_by(Report.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not reports:
+                return indexed
+            for report in reports:
+                ReportAnalytics.index_report(db, report)
+            db.commit()
+            indexed += len(reports)
+            last_id = reports[-1].id
+            db.expunge_all()
+
+    @staticmethod
+    def bucket_expr(column, bucket: str, dialect: str):
+        if bucket not in BUCKETS:
+            raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+        if dialect == "postgresql":
+            return func.date_trunc(bucket, column)
+        if dialect == "sqlite":
+            if bucket == "quarter":
+                quarter = (cast(func.strftime("%m", column), Integer) + 2) // 3
+                return func.strftime("%Y", column, type_=String) + "-Q" + cast(quarter, String)
+            return func.strftime(_SQLITE_FORMATS[bucket], column)
+        raise ValueError(f"Time buckets are not supported on {dialect}")
+
+    @staticmethod
+    def filter_metrics(
+        query,
+        names: Optional[List[str]] = None,
+        min_value: Optional[float] = None,
+        max_value: Optional[float] = None,
+        unit: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None
+    ):
+        if names:
+            query = query.where(ReportMetric.name_key.in_([normalize_metric_name(n) for n in names]))
+        if min_value is not None:
+            query = query.where(ReportMetric.value_num >= min_value)
+        if max_value is not None:
+            query = query.where(ReportMetric.value_num <= max_value)
+        if unit:
+            query = query.where(ReportMetric.unit == unit)
+        if created_after:
+            query = query.where(ReportMetric.created_at >= created_after)
+        if created_before:
+            query = query.where(ReportMetric.created_at < created_before)
+        return query
+
+    @staticmethod
+    def filter_trends(
+        query,
+        direction: Optional[str] = None,
+        impact: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None
+    ):
+        if direction:
+            query = query.where(ReportTrend.direction == direction.lower())
+        if impact:
+            query = query.where(ReportTrend.impact == impact.lower())
+        if created_after:
+            query = query.where(ReportTrend.created_at >= created_after)
+        if created_before:
+            query = query.where(ReportTrend.created_at < created_before)
+        return query
+
+    @staticmethod
+    def metric_summary_query(dialect: str, bucket: Optional[str] = None, **filters):
+        columns = [ReportMetric.name_key.label("name")]
+        if bucket:
+            columns.append(ReportAnalytics.bucket_expr(ReportMetric.created_at, bucket, dialect).label("bucket"))
+        group_by = list(columns)
+        columns += [
+            func.count().label("count"),
+            func.count(func.distinct(ReportMetric.report_id)).label("reports"),
+            func.count(ReportMetric.value_num).label("numeric_count"),
+            func.min(ReportMetric.value_num).label("min"),
+            func.max(ReportMetric.value_num).label("max"),
+            func.avg(ReportMetric.value_num).label("avg")
+        ]
+        query = ReportAnalytics.filter_metrics(select(*columns), **filters)
+        return query.group_by(*group_by).order_by(*group_by)
+
+    @staticmethod
+    def trend_summary_query(dialect: str, bucket: Optional[str] = None, **filters):
+        columns = [ReportTrend.direction, ReportTrend.impact]
+        if bucket:
+            columns.append(ReportAnalytics.bucket_expr(ReportTrend.created_at, bucket, dialect).label("bucket"))
+        group_by = list(columns)
+        columns += [
+            func.count().label("count"),
+            func.count(func.distinct(ReportTrend.report_id)).label("reports")
+        ]
+        query = ReportAnalytics.filter_trends(select(*columns), **filters)
+        return query.group_by(*group_by).order_by(*group_by)
+
+def summary_rows(rows) -> List[Dict[str, Any]]:
+    return [dict(row._mapping) for row in rows]
+
+if __name__ == "__main__":
+    from database import SessionLocal, init_db
+
+    init_db()
+    db = SessionLocal()
+    try:
+        print(f"Indexed {ReportAnalytics.backfill(db)} report(s)")
+    finally:
+        db.close()
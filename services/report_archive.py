@@ -0,0 +1,95 @@
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+import zstandard
+from sqlalchemy import func, null
+from sqlalchemy.orm import Session
+from config import settings
+from database import Report, ReportStage
+
+class ReportArchive:
+    # Moves old completed results out of the reports table into zstd-compressed
+    # objects in the storage backend. The row keeps a pointer and the summary;
+    # load_result reads either form, so callers don't care where a result lives.
+
+    def __init__(self, storage_service):
+        self.storage = storage_service
+
+    def _location(self, report_id: str) -> str:
+        return f"archive/reports/{report_id[:2]}/{report_id}.json.zst"
+
+    def archive_report(self, report: Report):
+        # Object first, then the row: a failed commit only leaves an object the next
+        # run overwrites, never a row pointing at nothing. Caller commits.
+        raw = json.dumps(report.result, separators=(",", ":")).encode("utf-8")
+        compressed = zstandard.ZstdCompressor(level=settings.REPORT_ARCHIVE_ZSTD_LEVEL).compress(raw)
+        report.result_location = self.storage.put_bytes(
+            self._location(report.report_id), compressed, content_type="application/zstd"
+        )
+        report.result_summary = (report.result or {}).get("summary")
+        report.result = null()  # SQL NULL, not JSON 'null', so the TOASTed value is freed
+        report.archived_at = datetime.utcnow()
+
+    def run_retention(self, db: Session, older_than_days: Optional[int] = None, batch_size: Optional[int] = None) -> int:
+        days = settings.REPORT_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+        batch_size = batch_size or settings.REPORT_ARCHIVE_BATCH_SIZE
+        cutoff = datetime.utcnow() - timedelta(days=days)
+
+        archived = 0
+        last_id = 0
+        while True:
+            reports = (
+                db.query(Report)
+                .filter(
+                    Report.id > last_id,
+                    Report.status == "completed",
+                    Report.result_location.is_(None),
+                    Report.result.isnot(None),
+                    # created_at for reports completed before completed_at existed
+                    func.coalesce(Report.completed_at, Report.created_at) < cutoff
+                )
+                .order_by(Report.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if not reports:
+                return archived
+            archived_ids = []
+            for report in reports:
+                try:
+                    self.archive_report(report)
+                    archived_ids.append(report.report_id)
+                except Exception as e:
+                    # Row is untouched; it is retried on the next run
+                    print(f"Error archiving report {report.report_id}: {e}")
+            # Stage checkpoints of old reports aren't worth keeping hot either
+            if archived_ids:
+                db.query(ReportStage).filter(ReportStage.report_id.in_(archived_ids)).delete(synchronize_session=False)
+            db.commit()
+            archived += len(archived_ids)
+            last_id = reports[-1].id
+            db.expunge_all()
+
+    def load_result(self, report: Report) -> Optional[Dict[str, Any]]:
+        if report.result is not None or not report.result_location:
+            return report.result
+        compressed = self.storage.get_bytes(report.result_location)
+        return json.loads(zstandard.ZstdDecompressor().decompress(compressed))
+
+if __name__ == "__main__":
+    import argparse
+    from database import SessionLocal, init_db
+    from services.storage_service import StorageService
+
+    parser = argparse.ArgumentParser(description="Move old report results to compressed cold storage")
+    parser.add_argument("--older-than-days", type=int, default=None)
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        count = ReportArchive(StorageService()).run_retention(db, args.older_than_days)
+        print(f"Archived {count} report(s)")
+    finally:
+        db.close()
@@ -0,0 +1,96 @@
+from typing import Any, Dict, List, Optional
+from sqlalchemy.orm import Session
+from database import ReportStage
+
+# Pipeline stages in execution order, and what must be redone when one is redone
+STAGES = ("csv", "vision", "prompt", "llm")
+DOWNSTREAM = {
+    "csv": ("prompt", "llm"),
+    "vision": ("prompt", "llm"),
+    "prompt": ("llm",),
+    "llm": ()
+}
+
+class StageCheckpoints:
+    # In-memory checkpoints, i.e. none survive the call; used by the instant endpoints
+
+    def __init__(self):
+        self._outputs: Dict[str, Any] = {}
+
+    def get(self, stage: str) -> Optional[Any]:
+        return self._outputs.get(stage)
+
+    def save(self, stage: str, output: Any, duration: Optional[float] = None):
+        self._outputs[stage] = output
+
+    def fail(self, stage: str, error: str):
+        pass
+
+class SharedCheckpoints(StageCheckpoints):
+    # Upstream stages computed once for several variant reports. A stage is reused
+    # only if every variant has it; results are written to all of them, so each
+    # variant can later be retried on its own.
+
+    def __init__(self, members: List[StageCheckpoints]):
+        super().__init__()
+        self.members = members
+
+    def get(self, stage: str) -> Optional[Any]:
+        outputs = [member.get(stage) for member in self.members]
+        return None if any(output is None for output in outputs) else outputs[0]
+
+    def save(self, stage: str, output: Any, duration: Optional[float] = None):
+        for member in self.members:
+            member.save(stage, output, duration)
+
+    def fail(self, stage: str, error: str):
+        for member in self.members:
+            member.fail(stage, error)
+
+class ReportCheckpoints(StageCheckpoints):
+    # Stage outputs persisted in report_stages, so a retry of the report only
+    # re-executes the stages that failed (and those downstream of them)
+
+    def __init__(self, db: Session, report_id: str):
+        super().__init__()
+        self.db = db
+        self.report_id = report_id
+        rows = db.query(ReportStage).filter(
+            ReportStage.report_id == report_id, ReportStage.status == "completed"
+        ).all()
+        self._outputs = {row.stage: row.output for row in rows}
+
+    def _row(self, stage: str) -> ReportStage:
+        row = self.db.query(ReportStage).filter(
+            ReportStage.report_id == self.report_id, ReportStage.stage == stage
+        ).first()
+        if row is None:
+            row = ReportStage(report_id=self.report_id, stage=stage, attempts=0)
+            self.db.add(row)
+        return row
+
+    def save(self, stage: str, output: Any, duration: Optional[float] = None):
+        super().save(stage, output)
+        row = self._row(stage)
+        row.status = "completed"
+        row.output = output
+        row.error = None
+        row.attempts = (row.attempts or 0) + 1
+        row.duration_seconds = duration
+        self.db.commit()
+
+    def fail(self, stage: str, error: str):
+        row = self._row(stage)
+        row.status = "failed"
+        row.error = error
+        row.attempts = (row.attempts or 0) + 1
+        self.db.commit()
+
+    @staticmethod
+    def reset(db: Session, report_id: str, from_stage: str) -> List[str]:
+        # Drop a stage's checkpoint and everything downstream; caller commits
+        stages = [from_stage, *DOWNSTREAM[from_stage]]
+        db.query(ReportStage).filter(
+            ReportStage.report_id == report_id, ReportStage.stage.in_(stages)
+        ).delete(synchronize_session=False)
+        return stages
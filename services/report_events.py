@@ -0,0 +1,96 @@
+import asyncio
+import json
+import select
+import threading
+from typing import Dict, Set, Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from config import settings
+
+CHANNEL = "report_status"
+TERMINAL_STATUSES = {"completed", "failed"}
+
+class ReportEventBus:
+    # In-process pub/sub of report status changes. On Postgres, publishers send
+    # NOTIFY and every API process LISTENs, so workers in other processes reach
+    # subscribers too; elsewhere (SQLite) only in-process publishers are seen.
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.use_notify = settings.DATABASE_URL.startswith("postgresql")
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def subscribe(self, report_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(report_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, report_id: str, queue: asyncio.Queue):
+        with self._lock:
+            queues = self._subscribers.get(report_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[report_id]
+
+    def _dispatch(self, report_id: str, status: str):
+        # Safe to call from any thread
+        with self._lock:
+            queues = list(self._subscribers.get(report_id, ()))
+        if not queues or self._loop is None:
+            return
+        event = {"report_id": report_id, "status": status}
+        for queue in queues:
+            self._loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def publish(self, db: Session, report_id: str, status: str):
+        # Call after the status change is committed
+        if self.use_notify:
+            try:
+                db.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {"channel": CHANNEL, "payload": json.dumps({"report_id": report_id, "status": status})}
+                )
+                db.commit()
+                return
+            except Exception as e:
+                print(f"Warning: NOTIFY failed, delivering in-process only: {e}")
+                db.rollback()
+        self._dispatch(report_id, status)
+
+    def start_listener(self):
+        if self.use_notify:
+            threading.Thread(target=self._listen_forever, name="report-events-listener", daemon=True).start()
+
+    def _listen_forever(self):
+        import psycopg2
+
+        dsn = settings.DATABASE_URL.replace("postgresql+psycopg2://", "postgresql://")
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f"LISTEN {CHANNEL}")
+                print(f"Listening for report status notifications on '{CHANNEL}'")
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        event = json.loads(notify.payload)
+                        self._dispatch(event["report_id"], event["status"])
+            except Exception as e:
+                print(f"Report events listener error, reconnecting: {e}")
+                threading.Event().wait(5)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+report_events = ReportEventBus()
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+from sqlalchemy import select
+from config import settings
+from database import AsyncSessionLocal, Report
+from .pdf_cache import result_hash
+from .pdf_render_pool import RenderPoolBusyError
+
+class _ZipSink:
+    # Write-only, unseekable file object for ZipFile; the export generator drains it
+    # after every entry, so at most one entry is buffered at a time
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+class ReportExporter:
+    # Streams many reports as NDJSON or a ZIP of PDFs. Reports are read in keyset
+    # batches and PDFs rendered through the PDF cache with a bounded window, so memory
+    # stays flat no matter how many reports match.
+
+    def __init__(self, pdf_cache, report_archive, batch_size: int = 50):
+        self.pdf_cache = pdf_cache
+        self.archive = report_archive
+        self.batch_size = batch_size
+
+    async def iter_reports(
+        self,
+        status: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        report_ids: Optional[List[str]] = None
+    ) -> AsyncIterator[Report]:
+        # Own short-lived session per batch: the response outlives the request's session,
+        # and no connection is held while the client downloads
+        last_id = 0
+        while True:
+            query = select(Report).where(Report.id > last_id)
+            if status:
+                query = query.where(Report.status == status)
+            if created_after:
+                query = query.where(Report.created_at >= created_after)
+            if created_before:
+                query = query.where(Report.created_at < created_before)
+            if report_ids:
+                query = query.where(Report.report_id.in_(report_ids))
+            async with AsyncSessionLocal() as db:
+                reports = (await db.execute(query.order_by(Report.id).limit(self.batch_size))).scalars().all()
+            if not reports:
+                return
+            for report in reports:
+                yield report
+            last_id = reports[-1].id
+
+    async def _load_result(self, report: Report):
+        if report.status != "completed":
+            return None
+        if report.result is not None or not report.result_location:
+            return report.result
+        return await asyncio.to_thread(self.archive.load_result, report)
+
+    async def ndjson(self, **filters) -> AsyncIterator[str]:
+        async for report in self.iter_reports(**filters):
+            try:
+                result = await self._load_result(report)
+            except Exception as e:
+                print(f"Export: could not load result for {report.report_id}: {e}")
+                result = None
+            yield json.dumps({
+                "report_id": report.report_id,
+                "status": report.status,
+                "data": result,
+                "error_message": report.error_message,
+                "created_at": report.created_at,
+                "updated_at": report.updated_at
+            }, default=str) + "\n"
+
+    async def _render_waiting(self, report_id: str, result, digest: str) -> str:
+        # A busy pool is back-pressure, not a failure: keep waiting for a render process
+        # (each attempt already blocks for PDF_RENDER_WAIT_SECONDS) instead of dropping
+        # the report into errors.txt
+        while True:
+            try:
+                return await asyncio.to_thread(self.pdf_cache.render, report_id, result, digest)
+            except RenderPoolBusyError:
+                continue
+
+    async def _render(self, report: Report):
+        # Returns (report, pdf bytes or None, error or None); never raises
+        try:
+            result = None
+            digest = report.result_hash
+            if digest is None:
+                result = await self._load_result(report)
+                digest = result_hash(result)
+            path = await asyncio.to_thread(self.pdf_cache.get_path, report.report_id, digest)
+            if path is None:
+                if result is None:
+                    result = await self._load_result(report)
+                path = await self._render_waiting(report.report_id, result, digest)
+            return report, await asyncio.to_thread(Path(path).read_bytes), None
+        except Exception as e:
+            return report, None, str(e)
+
+    def _write_entries(self, archive: zipfile.ZipFile, done, errors: List[str]):
+        for task in done:
+            report, pdf_bytes, error = task.result()
+            if error is not None:
+                print(f"Export: could not render {report.report_id}: {error}")
+                errors.append(f"{report.report_id}: {error}")
+                continue
+            entry = zipfile.ZipInfo(f"report_{report.report_id}.pdf", date_time=report.created_at.timetuple()[:6])
+            archive.writestr(entry, pdf_bytes)
+
+    async def zip(self, **filters) -> AsyncIterator[bytes]:
+        # Entries are written in completion order; PDFs are already compressed, so STORED
+        sink = _ZipSink()
+        archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+        window = settings.EXPORT_RENDER_CONCURRENCY
+        pending = set()
+        errors = []
+        try:
+            async for report in self.iter_reports(status="completed", **filters):
+                pending.add(asyncio.create_task(self._render(report)))
+                if len(pending) >= window:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    self._write_entries(archive, done, errors)
+                    yield sink.drain()
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                self._write_entries(archive, done, errors)
+                yield sink.drain()
+
+            if errors:
+                archive.writestr("errors.txt", "\n".join(errors) + "\n")
+            archive.close()
+            yield sink.drain()
+        finally:
+            # Client went away mid-download
+            for task in pending:
+                task.cancel()
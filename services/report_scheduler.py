@@ -0,0 +1,301 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Deque, Dict, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from config import settings
+from database import engine
+
+# Lanes in priority order: instant endpoints first, then queued report jobs
+LANES = ("interactive", "batch")
+
+# Advisory lock keys (namespace, key): keys 0..REPORT_MAX_CONCURRENCY-1 are the shared
+# slots, WAITING_KEY is held (shared mode) by processes with interactive requests waiting
+LOCK_NAMESPACE = 0x5250
+WAITING_KEY = -1
+
+class LaneFullError(HTTPException):
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(
+            status_code=429,
+            detail=f"Too many {lane} report requests, please retry later",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+class _Waiter:
+    # A queued request for a slot; granted and woken by whoever frees one
+    def __init__(self, wake: Callable[[], None]):
+        self.wake = wake
+        self.granted = False
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+class _SharedSlots:
+    # REPORT_MAX_CONCURRENCY across every process on the same Postgres database (API,
+    # embedded and separate workers). A running report holds one session advisory lock
+    # on its own connection, so a crashed process frees its slot with the connection.
+    # Batch work only takes a slot when no process has interactive requests waiting.
+    # On SQLite this is a no-op and the limits only hold per process.
+
+    def __init__(self, size: int):
+        self.size = size
+        self.enabled = settings.DATABASE_URL.startswith("postgresql")
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._waiting_conn: Optional[Connection] = None
+
+    def _lock_query(self, conn: Connection, function: str, key: int) -> bool:
+        return conn.execute(text(f"SELECT {function}(:ns, :key)"), {"ns": LOCK_NAMESPACE, "key": key}).scalar()
+
+    def try_acquire(self, lane: str) -> Optional[Tuple[Connection, int]]:
+        # Returns (connection, key) to hand back to release(), or None if no slot is free
+        conn = engine.connect()
+        held = None
+        try:
+            with conn.begin():
+                # The exclusive try fails while any interactive waiter holds WAITING_KEY;
+                # as a transaction lock it is dropped again on commit
+                if lane == "interactive" or self._lock_query(conn, "pg_try_advisory_xact_lock", WAITING_KEY):
+                    held = next((key for key in range(self.size) if self._lock_query(conn, "pg_try_advisory_lock", key)), None)
+        except Exception:
+            conn.invalidate()
+            conn.close()
+            raise
+        if held is None:
+            conn.close()
+            return None
+        return conn, held
+
+    def release(self, held: Tuple[Connection, int], unlock: str = "pg_advisory_unlock"):
+        conn, key = held
+        try:
+            self._lock_query(conn, unlock, key)
+            conn.commit()
+        except Exception as e:
+            print(f"Could not release report advisory lock {key}: {e}")
+            conn.invalidate()  # The lock goes away with the session
+        finally:
+            conn.close()
+
+    def add_waiter(self):
+        with self._lock:
+            if self._waiting == 0:
+                conn = engine.connect()
+                try:
+                    self._lock_query(conn, "pg_advisory_lock_shared", WAITING_KEY)
+                    conn.commit()
+                except Exception:
+                    conn.invalidate()
+                    conn.close()
+                    raise
+                self._waiting_conn = conn
+            self._waiting += 1
+
+    def remove_waiter(self):
+        with self._lock:
+            self._waiting -= 1
+            if self._waiting == 0:
+                self.release((self._waiting_conn, WAITING_KEY), unlock="pg_advisory_unlock_shared")
+                self._waiting_conn = None
+
+class ReportScheduler:
+    # Admission control for report generation in this process. Each lane has its own
+    # concurrency limit and all lanes share REPORT_MAX_CONCURRENCY, so instant requests
+    # and background jobs can't together exceed the Gemini quota. Freed slots are handed
+    # to waiters directly, interactive ones first; a lane whose wait queue is full
+    # rejects new work with a 429.
+    #
+    # Interactive requests wait on the event loop (admit) and only take a thread once
+    # admitted; worker threads running batch jobs wait on an Event (slot).
+    #
+    # Once admitted here, a report also needs one of the shared slots (_SharedSlots),
+    # which makes REPORT_MAX_CONCURRENCY and interactive priority hold across processes.
+    # Lane limits and wait queues stay per process.
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, int]] = None,
+        queue_sizes: Optional[Dict[str, int]] = None,
+        max_concurrency: Optional[int] = None
+    ):
+        self.limits = limits or settings.REPORT_LANE_CONCURRENCY
+        self.queue_sizes = queue_sizes or settings.REPORT_LANE_QUEUE_SIZE
+        self.max_concurrency = max_concurrency or settings.REPORT_MAX_CONCURRENCY
+        self._lock = threading.Lock()
+        self._running = {lane: 0 for lane in LANES}
+        self._waiters: Dict[str, Deque[_Waiter]] = {lane: deque() for lane in LANES}
+        self._avg_seconds: Dict[str, Optional[float]] = {lane: None for lane in LANES}
+        self.shared = _SharedSlots(self.max_concurrency)
+
+    def _has_capacity(self, lane: str) -> bool:
+        return self._running[lane] < self.limits[lane] and sum(self._running.values()) < self.max_concurrency
+
+    def _can_start(self, lane: str) -> bool:
+        # Lower lanes yield while a higher one has work waiting; within a lane, FIFO
+        ahead = LANES[:LANES.index(lane) + 1]
+        return self._has_capacity(lane) and not any(self._waiters[l] for l in ahead)
+
+    def _grant_waiting(self):
+        # Caller holds the lock
+        for lane in LANES:
+            while self._waiters[lane] and self._has_capacity(lane):
+                waiter = self._waiters[lane].popleft()
+                waiter.granted = True
+                self._running[lane] += 1
+                waiter.wake()
+            if self._waiters[lane]:
+                break
+
+    def _enqueue(self, lane: str, wake: Callable[[], None]) -> Optional[_Waiter]:
+        # Takes a slot right away (None) or queues a waiter; raises when the queue is full
+        with self._lock:
+            if self._can_start(lane):
+                self._running[lane] += 1
+                return None
+            if len(self._waiters[lane]) >= self.queue_sizes.get(lane, 0):
+                raise LaneFullError(lane, self.retry_after(lane, len(self._waiters[lane]) + 1))
+            waiter = _Waiter(wake)
+            self._waiters[lane].append(waiter)
+            return waiter
+
+    def _abandon(self, lane: str, waiter: _Waiter) -> bool:
+        # Stop waiting; True if a slot was granted meanwhile (the caller then owns it)
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters[lane].remove(waiter)
+            # Lower lanes may have been held back by this waiter
+            self._grant_waiting()
+            return False
+
+    def _release(self, lane: str, elapsed: Optional[float]):
+        # elapsed is None when the slot was given back without running a report
+        with self._lock:
+            self._running[lane] -= 1
+            if elapsed is not None:
+                previous = self._avg_seconds[lane]
+                self._avg_seconds[lane] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+            self._grant_waiting()
+
+    def _shared_timed_out(self, lane: str, deadline: Optional[float]):
+        if deadline is not None and time.monotonic() >= deadline:
+            raise LaneFullError(lane, self.retry_after(lane, len(self._waiters[lane]) + 1))
+
+    async def _acquire_shared_async(self, lane: str, deadline: Optional[float]):
+        if not self.shared.enabled:
+            return None
+        held = await asyncio.to_thread(self.shared.try_acquire, lane)
+        if held is not None:
+            return held
+        # All shared slots are busy: poll, and hold batch work back everywhere meanwhile
+        waiting = lane == "interactive"
+        if waiting:
+            await asyncio.to_thread(self.shared.add_waiter)
+        try:
+            while held is None:
+                self._shared_timed_out(lane, deadline)
+                await asyncio.sleep(settings.REPORT_SHARED_POLL_SECONDS)
+                held = await asyncio.to_thread(self.shared.try_acquire, lane)
+            return held
+        finally:
+            if waiting:
+                await asyncio.to_thread(self.shared.remove_waiter)
+
+    def _acquire_shared(self, lane: str, deadline: Optional[float]):
+        if not self.shared.enabled:
+            return None
+        held = self.shared.try_acquire(lane)
+        if held is not None:
+            return held
+        waiting = lane == "interactive"
+        if waiting:
+            self.shared.add_waiter()
+        try:
+            while held is None:
+                self._shared_timed_out(lane, deadline)
+                time.sleep(settings.REPORT_SHARED_POLL_SECONDS)
+                held = self.shared.try_acquire(lane)
+            return held
+        finally:
+            if waiting:
+                self.shared.remove_waiter()
+
+    def retry_after(self, lane: str, backlog: int = 1) -> int:
+        # Rough time for `backlog` queued items to drain at the lane's concurrency
+        avg = self._avg_seconds[lane] or settings.REPORT_DEFAULT_SECONDS
+        return max(1, math.ceil(avg * max(1, backlog) / self.limits[lane]))
+
+    @asynccontextmanager
+    async def admit(self, lane: str, timeout: Optional[float] = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = self._enqueue(lane, lambda: loop.call_soon_threadsafe(_resolve, future))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                if not self._abandon(lane, waiter):
+                    raise LaneFullError(lane, self.retry_after(lane, len(self._waiters[lane]) + 1))
+            except asyncio.CancelledError:
+                # Client went away; give back a slot granted in the meantime
+                if self._abandon(lane, waiter):
+                    self._release(lane, None)
+                raise
+
+        try:
+            shared = await self._acquire_shared_async(lane, deadline)
+        except BaseException:
+            self._release(lane, None)
+            raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            if shared is not None:
+                await asyncio.to_thread(self.shared.release, shared)
+            self._release(lane, time.monotonic() - started)
+
+    @contextmanager
+    def slot(self, lane: str, timeout: Optional[float] = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        granted = threading.Event()
+        waiter = self._enqueue(lane, granted.set)
+        if waiter is not None and not granted.wait(timeout) and not self._abandon(lane, waiter):
+            raise LaneFullError(lane, self.retry_after(lane, len(self._waiters[lane]) + 1))
+
+        try:
+            shared = self._acquire_shared(lane, deadline)
+        except BaseException:
+            self._release(lane, None)
+            raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            if shared is not None:
+                self.shared.release(shared)
+            self._release(lane, time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                lane: {
+                    "running": self._running[lane],
+                    "waiting": len(self._waiters[lane]),
+                    "limit": self.limits[lane],
+                    "queue_size": self.queue_sizes.get(lane, 0)
+                }
+                for lane in LANES
+            }
+
+report_scheduler = ReportScheduler()
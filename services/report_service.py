@@ -1,11 +1,24 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Callable, Tuple
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import time
+from config import settings
+from database import SessionLocal, Report
 from .csv_service import CSVService
 from .vision_service import VisionService
 from .llm_service import GeminiLLMService
 from .qdrant_service import QdrantService
 from .storage_service import StorageService
+from .report_checkpoints import StageCheckpoints, SharedCheckpoints
+from .report_archive import ReportArchive
 import json
+import hashlib
+
+class StageError(Exception):
+    def __init__(self, stage: str, message: str):
+        super().__init__(f"{stage} stage {message}")
+        self.stage = stage
 
 class ReportService:
     def __init__(self):
@@ -14,51 +27,205 @@ class ReportService:
         self.vision_service = VisionService()
         self.llm_service = GeminiLLMService()
         self.qdrant_service = QdrantService()
+        self.stage_executor = ThreadPoolExecutor(max_workers=settings.STAGE_WORKERS, thread_name_prefix="report-stage")
     
-    def generate_report(
+    def _run_stages(
+        self,
+        stages: Dict[str, Callable[[threading.Event], Any]],
+        on_complete: Optional[Callable[[str, Any, float], None]] = None
+    ) -> Dict[str, Any]:
+        # Runs independent stages side by side, each under its STAGE_TIMEOUTS budget.
+        # The first failure or timeout sets the cancel event the siblings poll and
+        # raises StageError; threads can't be killed, so cancellation is cooperative.
+        # on_complete runs in the calling thread as each stage finishes.
+        cancel = threading.Event()
+        started = time.monotonic()
+        futures = {self.stage_executor.submit(fn, cancel): name for name, fn in stages.items()}
+        deadlines = {name: started + settings.STAGE_TIMEOUTS.get(name, 300) for name in stages}
+        results = {}
+        try:
+            pending = set(futures)
+            while pending:
+                next_deadline = min(deadlines[futures[f]] for f in pending)
+                done, pending = wait(pending, timeout=max(0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = futures[future]
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        raise StageError(name, f"failed: {e}") from e
+                    elapsed = time.monotonic() - started
+                    print(f"  {name} stage finished in {elapsed:.1f}s")
+                    if on_complete is not None:
+                        on_complete(name, results[name], elapsed)
+                now = time.monotonic()
+                for future in pending:
+                    name = futures[future]
+                    if deadlines[name] <= now:
+                        raise StageError(name, f"timed out after {settings.STAGE_TIMEOUTS.get(name, 300)}s")
+            return results
+        finally:
+            if len(results) < len(stages):
+                cancel.set()
+                for future in futures:
+                    future.cancel()
+    
+    def _csv_stage(self, csv_file_paths: List[str], cancel: threading.Event) -> Dict[str, Any]:
+        csv_analyses = self.csv_service.analyze_multiple_csvs(csv_file_paths, should_stop=cancel.is_set)
+        csv_summary = self.csv_service.generate_data_summary(csv_analyses)
+        print(f"CSV Summary: {csv_summary}")
+        return {"analyses": csv_analyses, "summary": csv_summary}
+    
+    def _vision_stage(self, image_file_paths: List[str], cancel: threading.Event) -> Dict[str, Any]:
+        vision_results = self.vision_service.analyze_multiple_images(image_file_paths, should_stop=cancel.is_set)
+        return {"results": vision_results, "summary": self._format_vision_insights(vision_results)}
+    
+    def _llm_stage(self, prompt: str, cancel: threading.Event) -> Dict[str, Any]:
+        # Raw response is kept so a bad parse can be inspected without calling Gemini again
+        raw = self.llm_service.complete_json(prompt)
+        try:
+            insights = self.llm_service.parse_insights(raw)
+        except json.JSONDecodeError as e:
+            print(f"Response was: {raw[:500]}")
+            raise ValueError(f"LLM response is not valid JSON: {e}")
+        return {"raw": raw, "insights": insights}
+    
+    def run_upstream_stages(
         self,
         csv_file_paths: List[str],
         image_file_paths: List[str],
-        description: str
+        checkpoints: StageCheckpoints
+    ) -> Tuple[Dict[str, Any], bool]:
+        # CSV (CPU) and vision (network) concurrently, skipping checkpointed ones.
+        # Returns the outputs and whether anything was recomputed.
+        upstream = {stage: checkpoints.get(stage) for stage in ("csv", "vision")}
+        missing = {}
+        if upstream["csv"] is None:
+            missing["csv"] = lambda cancel: self._csv_stage(csv_file_paths, cancel)
+        if upstream["vision"] is None:
+            missing["vision"] = lambda cancel: self._vision_stage(image_file_paths, cancel)
+        if missing:
+            upstream.update(self._run_stages(missing, on_complete=checkpoints.save))
+        return upstream, bool(missing)
+    
+    def run_insight_stages(
+        self,
+        upstream: Dict[str, Any],
+        description: str,
+        checkpoints: StageCheckpoints,
+        recompute: bool = False
     ) -> Dict[str, Any]:
-        try:
-            # 1. Analyze CSV files
-            csv_analyses = self.csv_service.analyze_multiple_csvs(csv_file_paths)
-            csv_summary = self.csv_service.generate_data_summary(csv_analyses)
-            print(f"CSV Summary: {csv_summary}")
-            
-            # 2. Analyze images
-            vision_results = self.vision_service.analyze_multiple_images(image_file_paths)
-            vision_summary = self._format_vision_insights(vision_results)
-            
-            # 3. Generate insights using LLM
-            insights = self.llm_service.generate_insights(
-                csv_summary=csv_summary,
-                vision_insights=vision_summary,
+        # Prompt, then LLM; checkpoints are only reused when upstream wasn't recomputed
+        prompt_output = None if recompute else checkpoints.get("prompt")
+        if prompt_output is None:
+            prompt_output = {"prompt": self.llm_service.build_insights_prompt(
+                csv_summary=upstream["csv"]["summary"],
+                vision_insights=upstream["vision"]["summary"],
                 user_description=description
-            )
-            
-            # 4. Format final report
-            report_data = {
-                "summary": insights.get("summary", "No summary available"),
-                "key_metrics": insights.get("key_metrics", []),
-                "trends": insights.get("trends", []),
-                "correlations": insights.get("correlations", []),
-                "recommendations": insights.get("recommendations", []),
-                "visual_insights": insights.get("visual_insights", []),
-                "generated_at": datetime.utcnow().isoformat()
+            )}
+            checkpoints.save("prompt", prompt_output)
+            recompute = True
+        
+        llm_output = None if recompute else checkpoints.get("llm")
+        if llm_output is None:
+            llm_output = self._run_stages(
+                {"llm": lambda cancel: self._llm_stage(prompt_output["prompt"], cancel)},
+                on_complete=checkpoints.save
+            )["llm"]
+        insights = llm_output["insights"]
+        
+        # Format final report
+        return {
+            "summary": insights.get("summary", "No summary available"),
+            "key_metrics": insights.get("key_metrics", []),
+            "trends": insights.get("trends", []),
+            "correlations": insights.get("correlations", []),
+            "recommendations": insights.get("recommendations", []),
+            "visual_insights": insights.get("visual_insights", []),
+            "generated_at": datetime.utcnow().isoformat()
+        }
+    
+    def _stage_failure(self, e: Exception, checkpoints: StageCheckpoints) -> Dict[str, Any]:
+        if isinstance(e, StageError):
+            checkpoints.fail(e.stage, str(e))
+            return {
+                "success": False,
+                "error": str(e),
+                "stage": e.stage
             }
-            
+        return {
+            "success": False,
+            "error": str(e)
+        }
+    
+    def _generate_variant(
+        self,
+        upstream: Dict[str, Any],
+        description: str,
+        checkpoints: StageCheckpoints,
+        recompute: bool
+    ) -> Dict[str, Any]:
+        try:
             return {
                 "success": True,
-                "data": report_data
+                "data": self.run_insight_stages(upstream, description, checkpoints, recompute=recompute)
             }
-            
         except Exception as e:
-            return {
-                "success": False,
-                "error": str(e)
-            }
+            return self._stage_failure(e, checkpoints)
+    
+    def generate_report_variants(
+        self,
+        csv_file_paths: List[str],
+        image_file_paths: List[str],
+        descriptions: List[str],
+        checkpoints: Optional[List[StageCheckpoints]] = None
+    ) -> List[Dict[str, Any]]:
+        # CSV and vision run once for every variant; then each description gets its own
+        # prompt + LLM call, concurrently. One result per description, in order.
+        checkpoints = checkpoints or [StageCheckpoints() for _ in descriptions]
+        shared = SharedCheckpoints(checkpoints)
+        try:
+            upstream, recomputed = self.run_upstream_stages(csv_file_paths, image_file_paths, shared)
+        except Exception as e:
+            failure = self._stage_failure(e, shared)
+            return [dict(failure) for _ in descriptions]
+        
+        # Own short-lived pool: variant threads block on LLM stages in stage_executor
+        workers = max(1, min(len(descriptions), settings.VARIANT_CONCURRENCY))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-variant") as pool:
+            return list(pool.map(
+                lambda i: self._generate_variant(upstream, descriptions[i], checkpoints[i], recomputed),
+                range(len(descriptions))
+            ))
+    
+    def generate_report(
+        self,
+        csv_file_paths: List[str],
+        image_file_paths: List[str],
+        description: str,
+        checkpoints: Optional[StageCheckpoints] = None
+    ) -> Dict[str, Any]:
+        # With persistent checkpoints, a rerun only executes stages that haven't
+        # completed yet (and the ones downstream of anything it recomputes)
+        return self.generate_report_variants(
+            csv_file_paths,
+            image_file_paths,
+            [description],
+            [checkpoints or StageCheckpoints()]
+        )[0]
+    
+    def cache_key(self, csv_hashes: List[str], image_hashes: List[str], description: Optional[str]) -> str:
+        # Everything that determines a generated report: input bytes (in order, as the
+        # prompt numbers them), the normalized request and the models/prompt in use
+        parts = {
+            "csv": csv_hashes,
+            "images": image_hashes,
+            "description": " ".join((description or "").lower().split()),
+            "llm_model": self.llm_service.model,
+            "vision_model": self.vision_service.model,
+            "prompt_version": settings.REPORT_PROMPT_VERSION
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
     
     def _format_vision_insights(self, vision_results: List[Dict[str, str]]) -> str:
         insights = []
@@ -71,8 +238,28 @@ class ReportService:
         
         return "\n".join(insights) if insights else "No visual insights available"
     
-    def store_report_embedding(self, report_id: str, report_data: Dict[str, Any]):
-        return self.qdrant_service.store_report_embedding(report_id, report_data)
+    def store_report_embedding(self, report_id: str, report_data: Dict[str, Any], tags: Optional[List[str]] = None):
+        return self.qdrant_service.store_report_embedding(report_id, report_data, tags)
     
-    def search_similar_reports(self, query: str, limit: int = 5):
-        return self.qdrant_service.search_similar_reports(query, limit)
+    def search_similar_reports(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None):
+        return self.qdrant_service.search_similar_reports(query, limit, filters)
+    
+    def warmup_search(self, queries: List[str]) -> int:
+        return self.qdrant_service.warmup_queries(queries)
+    
+    def search_cache_stats(self) -> Dict[str, Any]:
+        return self.qdrant_service.query_cache.get_stats()
+    
+    def dedupe_report_embeddings(self) -> int:
+        # Reports whose only vectors predate the current encoder are re-embedded from their result
+        archive = ReportArchive(self.storage_service)
+
+        def load_report(report_id: str) -> Optional[Dict[str, Any]]:
+            db = SessionLocal()
+            try:
+                report = db.query(Report).filter(Report.report_id == report_id, Report.status == "completed").first()
+                return archive.load_result(report) if report is not None else None
+            finally:
+                db.close()
+
+        return self.qdrant_service.dedupe_collection(load_report)
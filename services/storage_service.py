@@ -1,63 +1,473 @@
 import os
+import base64
 import uuid
+import asyncio
+import hashlib
+import tempfile
+import functools
 import boto3
+import aiofiles
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+from datetime import datetime, timedelta
 from pathlib import Path
-from fastapi import UploadFile
+from fastapi import UploadFile, HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from config import settings
-from typing import Tuple
+from database import Blob, UploadedFile, PendingUpload
+from .disk_cache import ReadThroughDiskCache
+from typing import Tuple, Dict, Any, List, Optional
+
+class FileTooLargeError(HTTPException):
+    def __init__(self, max_size: int):
+        super().__init__(
+            status_code=413,
+            detail=f"File exceeds maximum upload size of {max_size // (1024 * 1024)}MB"
+        )
+
+def _sha256_base64(hex_digest: str) -> str:
+    # S3 checksum headers carry the raw digest base64-encoded
+    return base64.b64encode(bytes.fromhex(hex_digest)).decode("ascii")
 
 class StorageService:
     def __init__(self):
         self.use_local = settings.USE_LOCAL_STORAGE
+        self.chunk_size = settings.UPLOAD_CHUNK_SIZE
+        self.max_size = settings.MAX_FILE_SIZE
         if not self.use_local:
             self.s3_client = boto3.client(
                 's3',
                 aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
                 aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                region_name=settings.AWS_REGION
+                region_name=settings.AWS_REGION,
+                # Clients are thread-safe; size the pool for concurrent part transfers
+                config=Config(
+                    max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": 5, "mode": "adaptive"}
+                )
             )
             self.bucket_name = settings.S3_BUCKET_NAME
+            self.transfer_config = TransferConfig(
+                multipart_chunksize=settings.S3_PART_SIZE,
+                max_concurrency=settings.S3_MAX_CONCURRENT_PARTS
+            )
+            self.read_cache = ReadThroughDiskCache(
+                settings.S3_CACHE_DIR,
+                settings.S3_CACHE_MAX_BYTES,
+                settings.S3_CACHE_MIN_AGE_SECONDS
+            )
         else:
             self.local_path = Path(settings.LOCAL_STORAGE_PATH)
             self.local_path.mkdir(parents=True, exist_ok=True)
-    
-    async def upload_file(self, file: UploadFile, file_type: str) -> Tuple[str, str]:
-        file_id = str(uuid.uuid4())
-        file_extension = Path(file.filename).suffix
-        storage_filename = f"{file_id}{file_extension}"
-        
-        # Read file content
-        content = await file.read()
-        await file.seek(0)  # Reset file pointer
-        
+
+    def _check_declared_size(self, file: UploadFile):
+        # Backstop for the Content-Length check in main.py: the part is already spooled
+        # by now, but this stops us storing it (and catches chunked request bodies)
+        size = getattr(file, "size", None)
+        if size is not None and size > self.max_size:
+            raise FileTooLargeError(self.max_size)
+
+    async def _iter_chunks(self, file: UploadFile, hasher=None):
+        # Yields the body chunk by chunk, enforcing MAX_FILE_SIZE (and hashing, if given) as it goes
+        total = 0
+        while True:
+            chunk = await file.read(self.chunk_size)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > self.max_size:
+                raise FileTooLargeError(self.max_size)
+            if hasher is not None:
+                hasher.update(chunk)
+            yield chunk
+
+    async def _stream_to_path(self, file: UploadFile, path: Path):
+        # Write to a unique sibling .part file and rename, so readers never see a partial
+        # upload and concurrent uploads of the same blob don't share a temp file
+        part_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+        size = 0
+        try:
+            async with aiofiles.open(part_path, "wb") as f:
+                async for chunk in self._iter_chunks(file):
+                    await f.write(chunk)
+                    size += len(chunk)
+            os.replace(part_path, path)
+            return size
+        except BaseException:
+            if part_path.exists():
+                part_path.unlink()
+            raise
+
+    async def _run(self, fn, *args, **kwargs):
+        # boto3 is blocking; run it on a worker thread so the event loop keeps serving
+        return await asyncio.to_thread(functools.partial(fn, *args, **kwargs))
+
+    async def _stream_to_s3(self, file: UploadFile, s3_key: str):
+        # Bodies smaller than one part go up in a single put_object. Larger ones become a
+        # multipart upload whose parts upload in parallel; memory is bounded by
+        # S3_MAX_CONCURRENT_PARTS * S3_PART_SIZE.
+        upload_id = None
+        parts = []
+        in_flight = set()
+        buffer = bytearray()
+        part_number = 0
+        size = 0
+
+        async def submit(body: bytes):
+            nonlocal in_flight, part_number, upload_id
+            if upload_id is None:
+                upload = await self._run(self.s3_client.create_multipart_upload, Bucket=self.bucket_name, Key=s3_key)
+                upload_id = upload["UploadId"]
+            part_number += 1
+            in_flight.add(asyncio.ensure_future(self._run(self._upload_part, s3_key, upload_id, part_number, body)))
+            if len(in_flight) >= settings.S3_MAX_CONCURRENT_PARTS:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                parts.extend(task.result() for task in done)
+
+        try:
+            async for chunk in self._iter_chunks(file):
+                buffer.extend(chunk)
+                size += len(chunk)
+                if len(buffer) >= settings.S3_PART_SIZE:
+                    await submit(bytes(buffer))
+                    buffer.clear()
+
+            if upload_id is None:
+                await self._run(self.s3_client.put_object, Bucket=self.bucket_name, Key=s3_key, Body=bytes(buffer))
+                return size
+
+            if buffer:
+                await submit(bytes(buffer))
+            parts.extend(await asyncio.gather(*in_flight))
+            in_flight = set()
+
+            await self._run(
+                self.s3_client.complete_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": sorted(parts, key=lambda p: p["PartNumber"])}
+            )
+            return size
+        except BaseException:
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+            if upload_id is not None:
+                await self._run(self.s3_client.abort_multipart_upload, Bucket=self.bucket_name, Key=s3_key, UploadId=upload_id)
+            raise
+
+    def _upload_part(self, s3_key: str, upload_id: str, part_number: int, body: bytes) -> dict:
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket_name,
+            Key=s3_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=body
+        )
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    async def _hash_upload(self, file: UploadFile) -> Tuple[str, int]:
+        # Read-only pass over the part Starlette already spooled, so a duplicate upload
+        # costs no storage write at all
+        hasher = hashlib.sha256()
+        size = 0
+        async for chunk in self._iter_chunks(file, hasher):
+            size += len(chunk)
+        await file.seek(0)
+        return hasher.hexdigest(), size
+
+    def _blob_location(self, object_id: str, extension: str) -> str:
+        # One object per upload, so an object is only ever referenced by the transaction
+        # that wrote it until that commits. Extension is kept for mime-type detection.
+        return f"blobs/{object_id[:2]}/{object_id}{extension.lower()}"
+
+    async def _write_blob(self, file: UploadFile, location: str) -> str:
         if self.use_local:
             # Local storage
-            type_folder = self.local_path / file_type
-            type_folder.mkdir(exist_ok=True)
-            file_path = type_folder / storage_filename
-            
-            with open(file_path, "wb") as f:
-                f.write(content)
-            
-            storage_path = str(file_path)
+            file_path = self.local_path / location
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            await self._stream_to_path(file, file_path)
+            return str(file_path)
         else:
             # S3 storage
-            s3_key = f"{file_type}/{storage_filename}"
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=s3_key,
-                Body=content
+            await self._stream_to_s3(file, location)
+            return f"s3://{self.bucket_name}/{location}"
+
+    def _add_reference(self, db: Session, content_hash: str) -> bool:
+        # Atomic increment; False if the blob row is gone (e.g. just garbage collected)
+        updated = db.query(Blob).filter(Blob.content_hash == content_hash).update(
+            {Blob.ref_count: Blob.ref_count + 1, Blob.last_referenced_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+        return updated == 1
+
+    def _reference_existing(self, db: Session, content_hash: str) -> Optional[str]:
+        blob = db.query(Blob).filter(Blob.content_hash == content_hash).first()
+        if blob is not None and self._add_reference(db, content_hash):
+            return blob.storage_path
+        return None
+
+    async def _db_call(self, db: AsyncSession, fn, *args):
+        # Run sync blob bookkeeping on the async session; AsyncSession forbids concurrent
+        # operations, so calls from gathered uploads are serialized (their I/O is not)
+        lock = db.info.setdefault("storage_lock", asyncio.Lock())
+        async with lock:
+            return await db.run_sync(fn, *args)
+
+    async def upload_file(self, file: UploadFile, file_type: str, db: AsyncSession) -> Tuple[str, str, str]:
+        # Content-addressed: identical bytes share one Blob; the caller commits the session.
+        # If the caller rolls back instead, it should pass the returned paths to discard_uploads.
+        self._check_declared_size(file)
+        file_id = str(uuid.uuid4())
+        content_hash, size = await self._hash_upload(file)
+
+        storage_path = await self._db_call(db, self._reference_existing, content_hash)
+        if storage_path is not None:
+            return file_id, storage_path, content_hash
+
+        # New content: only now is anything written
+        written_path = await self._write_blob(file, self._blob_location(file_id, Path(file.filename).suffix))
+        try:
+            storage_path = await self._db_call(db, self._register_blob, content_hash, written_path, size)
+        except BaseException:
+            await self._run(self._delete_object, written_path)
+            raise
+        if storage_path != written_path:
+            # A concurrent upload of the same bytes registered its blob first
+            await self._run(self._delete_object, written_path)
+
+        await file.seek(0)  # Reset file pointer
+        return file_id, storage_path, content_hash
+
+    def discard_uploads(self, db: Session, storage_paths: List[str]) -> int:
+        # After a rollback: delete objects this request wrote whose Blob row never committed.
+        # Paths of pre-existing blobs the request merely referenced still have their row.
+        registered = {
+            path for (path,) in db.query(Blob.storage_path).filter(Blob.storage_path.in_(storage_paths))
+        }
+        orphaned = [path for path in storage_paths if path not in registered]
+        for path in orphaned:
+            self._delete_object(path)
+        return len(orphaned)
+
+    def _register_blob(self, db: Session, content_hash: str, storage_path: str, size: int) -> str:
+        try:
+            with db.begin_nested():
+                db.add(Blob(
+                    content_hash=content_hash,
+                    storage_path=storage_path,
+                    size_bytes=size,
+                    ref_count=1
+                ))
+        except IntegrityError:
+            # A concurrent upload of the same bytes registered the blob first
+            self._add_reference(db, content_hash)
+            storage_path = db.query(Blob.storage_path).filter(Blob.content_hash == content_hash).scalar()
+        return storage_path
+
+    def create_presigned_upload(self, db: AsyncSession, file_name: str, file_type: str, sha256: str) -> Dict[str, Any]:
+        # Client POSTs the bytes straight to the bucket. S3 enforces MAX_FILE_SIZE and
+        # verifies the declared SHA-256, so the API never has to read the bytes to hash them.
+        upload_id = str(uuid.uuid4())
+        s3_key = f"incoming/{upload_id}{Path(file_name).suffix.lower()}"
+        checksum = _sha256_base64(sha256)
+        presigned = self.s3_client.generate_presigned_post(
+            Bucket=self.bucket_name,
+            Key=s3_key,
+            Fields={"x-amz-checksum-sha256": checksum},
+            Conditions=[["content-length-range", 1, self.max_size], {"x-amz-checksum-sha256": checksum}],
+            ExpiresIn=settings.S3_PRESIGN_EXPIRES
+        )
+        db.add(PendingUpload(
+            upload_id=upload_id,
+            s3_key=s3_key,
+            file_name=file_name,
+            file_type=file_type,
+            content_hash=sha256.lower()
+        ))
+        return {
+            "upload_id": upload_id,
+            "url": presigned["url"],
+            "fields": presigned["fields"],
+            "expires_in": settings.S3_PRESIGN_EXPIRES
+        }
+
+    async def complete_presigned_upload(self, db: AsyncSession, pending: PendingUpload) -> Tuple[str, str, str]:
+        # S3 checked the bytes against the declared SHA-256 on upload; confirm that from the
+        # object's stored checksum (no bytes through the API), then dedupe against existing
+        # blobs with a server-side copy
+        head = await self._run(
+            self.s3_client.head_object, Bucket=self.bucket_name, Key=pending.s3_key, ChecksumMode="ENABLED"
+        )
+        if head["ContentLength"] > self.max_size:
+            await self._run(self.s3_client.delete_object, Bucket=self.bucket_name, Key=pending.s3_key)
+            raise FileTooLargeError(self.max_size)
+        if not pending.content_hash or head.get("ChecksumSHA256") != _sha256_base64(pending.content_hash):
+            await self._run(self.s3_client.delete_object, Bucket=self.bucket_name, Key=pending.s3_key)
+            raise HTTPException(status_code=400, detail="Uploaded object does not match the declared sha256")
+
+        content_hash = pending.content_hash
+        file_id = str(uuid.uuid4())
+
+        storage_path = await self._db_call(db, self._reference_existing, content_hash)
+        if storage_path is None:
+            location = self._blob_location(file_id, Path(pending.file_name).suffix)
+            await self._run(
+                self.s3_client.copy,
+                {"Bucket": self.bucket_name, "Key": pending.s3_key},
+                self.bucket_name,
+                location,
+                Config=self.transfer_config
+            )
+            copied_path = f"s3://{self.bucket_name}/{location}"
+            storage_path = await self._db_call(db, self._register_blob, content_hash, copied_path, head["ContentLength"])
+            if storage_path != copied_path:
+                await self._run(self._delete_object, copied_path)
+
+        await self._run(self.s3_client.delete_object, Bucket=self.bucket_name, Key=pending.s3_key)
+        return file_id, storage_path, content_hash
+
+    def release_file(self, db: Session, uploaded_file: UploadedFile):
+        # Drop one reference; the blob itself is removed later by collect_garbage
+        if uploaded_file.content_hash:
+            db.query(Blob).filter(Blob.content_hash == uploaded_file.content_hash).update(
+                {Blob.ref_count: Blob.ref_count - 1, Blob.last_referenced_at: datetime.utcnow()},
+                synchronize_session=False
+            )
+        else:
+            # Pre-dedup upload owns its object outright
+            self._delete_object(uploaded_file.storage_path)
+
+    def _iter_blob_objects(self):
+        # (storage_path, last modified) of every object under blobs/
+        if self.use_local:
+            root = self.local_path / "blobs"
+            if root.exists():
+                for path in root.rglob("*"):
+                    if path.is_file():
+                        yield str(path), datetime.utcfromtimestamp(path.stat().st_mtime)
+            return
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix="blobs/"):
+            for obj in page.get("Contents", []):
+                modified = obj["LastModified"].replace(tzinfo=None)  # S3 reports UTC
+                yield f"s3://{self.bucket_name}/{obj['Key']}", modified
+
+    def sweep_orphans(self, db: Session, cutoff: datetime, batch_size: int = 500) -> int:
+        # Objects with no Blob row: written by a request that rolled back or crashed
+        # before committing (and never discarded), or left as .part files
+        removed = 0
+        batch = []
+
+        def flush():
+            nonlocal removed
+            paths = [path for path, _ in batch]
+            known = {p for (p,) in db.query(Blob.storage_path).filter(Blob.storage_path.in_(paths))}
+            known |= {p for (p,) in db.query(UploadedFile.storage_path).filter(UploadedFile.storage_path.in_(paths))}
+            for path in paths:
+                if path not in known:
+                    self._delete_object(path)
+                    removed += 1
+            batch.clear()
+
+        for path, modified in self._iter_blob_objects():
+            if modified < cutoff:
+                batch.append((path, modified))
+                if len(batch) >= batch_size:
+                    flush()
+        if batch:
+            flush()
+        return removed
+
+    def collect_garbage(self, db: Session, grace_seconds: int = None) -> int:
+        # Grace period keeps blobs an in-flight upload may be about to reference
+        grace = settings.BLOB_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+        cutoff = datetime.utcnow() - timedelta(seconds=grace)
+        candidates = db.query(Blob).filter(Blob.ref_count <= 0, Blob.last_referenced_at < cutoff).all()
+
+        removed = 0
+        for blob in candidates:
+            # Conditional delete loses to any upload that re-referenced the blob meanwhile
+            deleted = db.query(Blob).filter(Blob.id == blob.id, Blob.ref_count <= 0).delete(
+                synchronize_session=False
             )
-            storage_path = f"s3://{self.bucket_name}/{s3_key}"
-        
-        return file_id, storage_path
-    
+            db.commit()
+            if deleted:
+                self._delete_object(blob.storage_path)
+                removed += 1
+        return removed + self.sweep_orphans(db, cutoff)
+
+    def _delete_object(self, storage_path: str):
+        try:
+            if self.use_local:
+                Path(storage_path).unlink(missing_ok=True)
+            else:
+                s3_key = storage_path.replace(f"s3://{self.bucket_name}/", "")
+                self.s3_client.delete_object(Bucket=self.bucket_name, Key=s3_key)
+        except Exception as e:
+            print(f"Warning: could not delete {storage_path}: {e}")
+
+    async def save_temp_file(self, file: UploadFile, suffix: str) -> str:
+        # Stream an upload to a temp file for the instant endpoints; caller deletes it
+        self._check_declared_size(file)
+        fd, temp_path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:
+                async for chunk in self._iter_chunks(file):
+                    await f.write(chunk)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return temp_path
+
+    def put_bytes(self, location: str, data: bytes, content_type: str = "application/octet-stream") -> str:
+        # Small whole-object writes (archived results, rendered files); overwrites location
+        if self.use_local:
+            file_path = self.local_path / location
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            part_path = file_path.with_name(f"{file_path.name}.{uuid.uuid4().hex}.part")
+            part_path.write_bytes(data)
+            os.replace(part_path, file_path)
+            return str(file_path)
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=location, Body=data, ContentType=content_type)
+        return f"s3://{self.bucket_name}/{location}"
+
+    def get_bytes(self, storage_path: str) -> bytes:
+        if self.use_local:
+            return Path(storage_path).read_bytes()
+        s3_key = storage_path.replace(f"s3://{self.bucket_name}/", "")
+        return self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)["Body"].read()
+
+    def get_object_path(self, location: str) -> Optional[str]:
+        # Local path of the object at location, or None if it doesn't exist
+        if self.use_local:
+            file_path = self.local_path / location
+            return str(file_path) if file_path.exists() else None
+        try:
+            return self.get_file_path(f"s3://{self.bucket_name}/{location}")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return None
+            raise
+
     def get_file_path(self, storage_path: str) -> str:
         if self.use_local:
             return storage_path
         else:
-            # Download from S3 to temp location
+            # Read-through local cache; the caller must not delete the returned file
             s3_key = storage_path.replace(f"s3://{self.bucket_name}/", "")
-            temp_path = f"/tmp/{Path(s3_key).name}"
-            self.s3_client.download_file(self.bucket_name, s3_key, temp_path)
-            return temp_path
+            return self.read_cache.get(
+                s3_key,
+                lambda dest: self.s3_client.download_file(
+                    self.bucket_name, s3_key, dest, Config=self.transfer_config
+                )
+            )
+
+    def cache_stats(self) -> dict:
+        if self.use_local:
+            return {"enabled": False}
+        return {"enabled": True, **self.read_cache.get_stats()}
@@ -1,7 +1,7 @@
 from PIL import Image
 from transformers import BlipProcessor, BlipForConditionalGeneration
 import torch
-from typing import List, Dict
+from typing import List, Dict, Optional, Callable
 from config import settings
 from google import genai
 from google.genai import types
@@ -41,9 +41,12 @@ class BlipVisionService:
                 "status": "error"
             }
     
-    def analyze_multiple_images(self, image_paths: List[str]) -> List[Dict[str, str]]:
+    def analyze_multiple_images(self, image_paths: List[str], should_stop: Optional[Callable[[], bool]] = None) -> List[Dict[str, str]]:
         results = []
         for idx, path in enumerate(image_paths):
+            # Cooperative cancellation between images
+            if should_stop is not None and should_stop():
+                break
             result = self.analyze_image(path)
             result["image_index"] = idx
             result["image_path"] = path
@@ -108,9 +111,12 @@ class VisionService:
                 "status": "error"
             }
     
-    def analyze_multiple_images(self, image_paths: List[str]) -> List[Dict[str, str]]:
+    def analyze_multiple_images(self, image_paths: List[str], should_stop: Optional[Callable[[], bool]] = None) -> List[Dict[str, str]]:
         results = []
         for idx, path in enumerate(image_paths):
+            # Cooperative cancellation between images
+            if should_stop is not None and should_stop():
+                break
             result = self.analyze_image(path)
             result["image_index"] = idx
             result["image_path"] = path
@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal, init_db, Job, Report
+from services.job_queue import JobQueue
+from services.report_events import report_events
+from services.report_analytics import ReportAnalytics
+from services.pdf_cache import PdfCache, result_hash
+from services.pdf_render_pool import pdf_render_pool
+from services.report_checkpoints import ReportCheckpoints
+from services.report_scheduler import report_scheduler
+
+REPORT_GENERATION = "report_generation"
+
+def _report_variants(payload: dict) -> List[Tuple[str, str]]:
+    # A single report is a fan-out of one
+    if "report_ids" in payload:
+        return list(zip(payload["report_ids"], payload["descriptions"]))
+    return [(payload["report_id"], payload["description"])]
+
+def _set_status(db: Session, reports: List[Report], status: str):
+    for report in reports:
+        report.status = status
+    db.commit()
+    for report in reports:
+        report_events.publish(db, report.report_id, status)
+
+def _complete_report(db: Session, report: Report, data: dict, tags, report_service, storage_service):
+    report_id = report.report_id
+
+    # Store embedding in Qdrant
+    print("→ Storing embeddings in Qdrant...")
+    report_service.store_report_embedding(report_id, data, tags)
+
+    # Update database
+    report.status = "completed"
+    report.result = data
+    report.result_hash = result_hash(data)
+    report.error_message = None
+    report.updated_at = report.completed_at = datetime.utcnow()
+    ReportAnalytics.index_report(db, report)
+    db.commit()
+    report_events.publish(db, report_id, "completed")
+    print(f"✓ Report {report_id} completed and stored")
+
+    if settings.PDF_PRERENDER_ON_COMPLETE:
+        # Best effort: the PDF endpoint renders on demand if this didn't happen
+        try:
+            PdfCache(storage_service).get_or_render(report_id, data, report.result_hash)
+        except Exception as e:
+            print(f"Warning: PDF pre-render failed for {report_id}: {e}")
+
+def process_report_generation(job: Job, db: Session, report_service, storage_service):
+    payload = job.payload
+    descriptions = dict(_report_variants(payload))
+    variant_sessions = []
+
+    try:
+        # On a retry, variants that already completed are left as they are
+        reports = db.query(Report).filter(
+            Report.report_id.in_(list(descriptions)), Report.status != "completed"
+        ).all()
+        if not reports:
+            return
+        print(f"\n Processing report(s): {', '.join(r.report_id for r in reports)} (attempt {job.attempts})")
+
+        # Batch lane: waits while instant requests are using the capacity
+        with report_scheduler.slot("batch"):
+            # Update status to processing
+            _set_status(db, reports, "processing")
+
+            # Resolve storage paths here, so the worker can run on a different host than the API.
+            # Only once admitted: with S3 this downloads the inputs, which shouldn't pile up
+            # on local disk for jobs still waiting for a slot.
+            csv_paths = [storage_service.get_file_path(p) for p in payload["csv_storage_paths"]]
+            image_paths = [storage_service.get_file_path(p) for p in payload["image_storage_paths"]]
+
+            # Generate report(s) using Gemini. CSV and vision run once for all variants;
+            # stages that completed on an earlier attempt are loaded, not recomputed.
+            # Each variant checkpoints through its own session since its LLM stage runs on its own thread.
+            print("→ Generating report with Gemini AI...")
+            variant_sessions = [SessionLocal() for _ in reports]
+            checkpoints = [ReportCheckpoints(session, r.report_id) for session, r in zip(variant_sessions, reports)]
+            results = report_service.generate_report_variants(
+                csv_paths, image_paths, [descriptions[r.report_id] for r in reports], checkpoints
+            )
+
+        failed = []
+        for report, result in zip(reports, results):
+            if result["success"]:
+                print("✓ Report generated successfully!")
+                _complete_report(db, report, result["data"], payload.get("tags"), report_service, storage_service)
+            else:
+                print(f"✗ Report generation failed: {result.get('error')}")
+                failed.append((report, result.get("error", "Unknown error")))
+
+        if failed and job.attempts < job.max_attempts:
+            # Let the queue retry; only the failed stages run again
+            raise RuntimeError("; ".join(error for _, error in failed))
+        for report, error in failed:
+            report.status = "failed"
+            report.error_message = error
+        if failed:
+            db.commit()
+            for report, _ in failed:
+                report_events.publish(db, report.report_id, "failed")
+
+    except Exception as e:
+        print(f"✗ Error processing report: {str(e)}")
+        db.rollback()
+        unfinished = db.query(Report).filter(
+            Report.report_id.in_(list(descriptions)), Report.status != "completed"
+        ).all()
+        if job.attempts < job.max_attempts:
+            # Let the queue retry; the reports go back to pending meanwhile
+            _set_status(db, unfinished, "pending")
+            raise
+        for report in unfinished:
+            report.error_message = str(e)
+        _set_status(db, unfinished, "failed")
+    finally:
+        for session in variant_sessions:
+            session.close()
+
+def build_handlers(report_service, storage_service) -> Dict[str, Callable[[Job, Session], None]]:
+    return {
+        REPORT_GENERATION: lambda job, db: process_report_generation(job, db, report_service, storage_service)
+    }
+
+class Worker:
+    def __init__(self, handlers: Dict[str, Callable[[Job, Session], None]], concurrency: Dict[str, int] = None):
+        self.handlers = handlers
+        self.concurrency = concurrency or settings.JOB_CONCURRENCY
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_reclaim = 0.0
+        self._reclaim_lock = threading.Lock()
+
+    def start(self):
+        for job_type, slots in self.concurrency.items():
+            if job_type not in self.handlers:
+                print(f"Warning: no handler for job type {job_type}")
+                continue
+            for slot in range(slots):
+                thread = threading.Thread(
+                    target=self._run_slot,
+                    args=(job_type,),
+                    name=f"worker-{job_type}-{slot}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        print(f"Worker {self.worker_id} started: {self.concurrency}")
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _maybe_reclaim(self, db: Session):
+        # One reclaim sweep per interval per process is plenty
+        now = time.monotonic()
+        if now - self._last_reclaim < settings.JOB_HEARTBEAT_INTERVAL or not self._reclaim_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_reclaim = now
+            reclaimed = JobQueue.reclaim_stale(db)
+            if reclaimed:
+                print(f"Reclaimed {reclaimed} stale job(s)")
+        finally:
+            self._reclaim_lock.release()
+
+    def _run_slot(self, job_type: str):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                self._maybe_reclaim(db)
+                job = JobQueue.claim(db, [job_type], self.worker_id)
+                if job is None:
+                    self._stop.wait(settings.JOB_POLL_INTERVAL)
+                    continue
+                self._execute(job, db)
+            except Exception as e:
+                print(f"Worker loop error: {e}")
+                self._stop.wait(settings.JOB_POLL_INTERVAL)
+            finally:
+                db.close()
+
+    def _execute(self, job: Job, db: Session):
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job.job_id, done), daemon=True)
+        heartbeat.start()
+        try:
+            self.handlers[job.job_type](job, db)
+            JobQueue.complete(db, job.job_id, self.worker_id)
+        except Exception as e:
+            db.rollback()
+            JobQueue.fail(db, job.job_id, self.worker_id, str(e))
+        finally:
+            done.set()
+            heartbeat.join()
+
+    def _heartbeat(self, job_id: str, done: threading.Event):
+        # Separate session: the handler's session may be mid-transaction
+        db = SessionLocal()
+        try:
+            while not done.wait(settings.JOB_HEARTBEAT_INTERVAL):
+                if not JobQueue.heartbeat(db, job_id, self.worker_id):
+                    print(f"Lost ownership of job {job_id}")
+                    return
+        except Exception as e:
+            print(f"Heartbeat error for job {job_id}: {e}")
+        finally:
+            db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run report generation workers")
+    parser.add_argument(
+        "--concurrency",
+        type=json.loads,
+        default=None,
+        help='Slots per job type as JSON, e.g. \'{"report_generation": 4}\''
+    )
+    args = parser.parse_args()
+
+    from services.report_service import ReportService
+    from services.storage_service import StorageService
+
+    init_db()
+    if settings.PDF_PRERENDER_ON_COMPLETE:
+        # Fork the render processes before the worker threads start
+        pdf_render_pool.start()
+    worker = Worker(build_handlers(ReportService(), StorageService()), args.concurrency)
+    worker.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping worker...")
+        worker.stop(timeout=30)